@@ -36,6 +36,7 @@ import logging
 
 from ukManager import UkManager
 from utils import CustomFormatter, logger
+from metrics import metrics
 
 # Some constants for default arguments values
 WORKSPACE   ="/home/gain/unikraft/"
@@ -66,8 +67,28 @@ def main():
     parser.add_argument('-v', '--verbose',       help='Verbose', type=str2bool, nargs='?', const=True, default=True)
     parser.add_argument('-u', '--uks',           help='Unikernels to align as a list (-l uks1 uks2 ...)', nargs='+', default=UKS_INCLUDED)
     parser.add_argument('-c', '--custom_loader', help='Move individual lib out of RO space (for custom loader)', type=str2bool, nargs='?', const=True, default=True)
+    parser.add_argument('-p', '--pack',          help="Pack small .text libs used by the same unikernels in shared pages", type=str2bool, nargs='?', const=True, default=False)
     parser.add_argument('-o', '--copy_objs',     help="Copy object files to keep consistency", type=str2bool, nargs='?', const=True, default=True)
+    parser.add_argument('-j', '--jobs',          help="Number of parallel jobs", type=int, default=1)
+    parser.add_argument('--cache',               help="Path to the section cache of object files (disabled if not set)", type=str, default=None)
+    parser.add_argument('--cache_size',          help="Maximum number of entries of the section cache", type=int, default=100000)
+    parser.add_argument('--cache_hash',          help="Validate the section cache with a content hash", type=str2bool, nargs='?', const=True, default=False)
+    parser.add_argument('--store',               help="Directory of the content-addressed store used to copy object files (disabled if not set)", type=str, default=None)
+    parser.add_argument('--store_hardlink',      help="Allow hardlinks to the store when reflinks are not supported", type=str2bool, nargs='?', const=True, default=True)
+    parser.add_argument('--estimate',            help="Only estimate the page sharing of the relinked unikernels", type=str2bool, nargs='?', const=True, default=False)
+    parser.add_argument('--estimate_json',       help="Write the page sharing estimation to this json file", type=str, default=None)
+    parser.add_argument('--state',               help="Path to the layout state of the fleet (written by an alignment, read by --add)", type=str, default=None)
+    parser.add_argument('--reserve',             help="Bytes reserved (.text, .rodata, .data and .bss) for the libs of unikernels added later", type=int, default=0)
+    parser.add_argument('--add',                 help="Add a unikernel to an aligned fleet (see --state) without relinking the others", type=str, default=None)
+    parser.add_argument('--plan',                help="Only compute the layout and write it to this json file (the workspace is not modified)", type=str, default=None)
+    parser.add_argument('--cluster',             help="Align clusters of similar unikernels independently (Jaccard threshold, 0: disabled)", type=float, default=0.0)
+    parser.add_argument('--metrics',             help="Write the time of each phase and the counters of the run to this json file", type=str, default=None)
+    parser.add_argument('--metrics_prom',        help="Write the metrics of the run to this file (Prometheus text format)", type=str, default=None)
     parser.add_argument('--aslr',                help="Use aslr (0: disabled - 1: fixed indirection table - 2: with ASLR support)", type=int, default=0)
+    parser.add_argument('--aslr_inplace',        help="Rewrite the binaries in place (mmap, only .text.<lib> and .ind.<lib> are written)", type=str2bool, nargs='?', const=True, default=False)
+    parser.add_argument('--daemon',              help="Keep the fleet in memory and serve requests (add, remove, realign, relink, status) on this Unix socket", type=str, default=None)
+    parser.add_argument('--watch',               help="Interval (seconds) of the polling of the build folders by the daemon (0: disabled)", type=float, default=2.0)
+    parser.add_argument('--aslr_trace',          help="Write the rewritten instructions of each unikernel to <unikernel>.trace.jsonl", type=str2bool, nargs='?', const=True, default=False)
     args = parser.parse_args()
 
     if args.verbose:
@@ -83,14 +104,67 @@ def main():
     ch.setFormatter(CustomFormatter())
     logger.addHandler(ch)
 
+    try:
+        align(args)
+    finally:
+        if args.metrics is not None:
+            metrics.save_json(args.metrics)
+        if args.metrics_prom is not None:
+            metrics.save_prometheus(args.metrics_prom)
+
+def align(args):
+
+    if args.estimate:
+        from pageSharing import estimate_fleet
+        estimate_fleet(args.workspace + "apps", args.uks, args.aslr, args.estimate_json)
+        return
+
+    if args.daemon is not None:
+        from fleetDaemon import serve
+        serve(args, align_fleet)
+        return
+
     ukManager = UkManager(args)
+    if args.add is not None:
+        ukManager.add_unikernel(args.add)
+        return
+
     ukManager.process_folder()
-    ukManager.process_maps()
 
-    if ukManager.copy_objs:
-        ukManager.copy_all_objs()
+    if args.plan is not None:
+        if args.cluster > 0:
+            plan = {"clusters": list()}
+            for cluster in ukManager.split_clusters(args.cluster):
+                cluster.process_maps()
+                plan["clusters"].append(cluster.layout_plan(args.custom_loader))
+        else:
+            ukManager.process_maps()
+            plan = ukManager.layout_plan(args.custom_loader)
+        ukManager.save_plan(args.plan, plan)
+        return
+
+    align_fleet(ukManager, args)
+
+def align_fleet(ukManager, args):
+
+    # Layout, link files, relink and rewrite of the scanned unikernels (also used by the daemon)
+    if args.cluster > 0:
+        if ukManager.copy_objs:
+            ukManager.copy_all_objs()
+
+        clusters = ukManager.split_clusters(args.cluster)
+        for cluster in clusters:
+            cluster.process_maps()
+            cluster.update_link_file(args.custom_loader)
+        if ukManager.aslr == 0:
+            ukManager.report_clusters(clusters)
+    else:
+        ukManager.process_maps()
+
+        if ukManager.copy_objs:
+            ukManager.copy_all_objs()
 
-    ukManager.update_link_file(args.custom_loader)
+        ukManager.update_link_file(args.custom_loader)
     
     if ukManager.aslr > 0:
         ukManager.binary_rewrite()
@@ -31,28 +31,69 @@
 
 import os
 import re
-import sys
 import json
+import mmap
 import lief
+import struct
 import argparse
 
-from collections import defaultdict
+from bisect import bisect_left, bisect_right
 from capstone import *
+from capstone.x86 import X86_OP_IMM, X86_OP_MEM, X86_REG_RIP
+from collections import Counter
 from binascii import hexlify
-from subprocess import run, PIPE
+from array import array
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
 VERBOSE=False
 verbose = VERBOSE
+# Trace of the rewriting decisions (None: disabled)
+trace = None
 
 WORKDIR="/home/gain/unikraft/apps/lib-helloworld-remove/build"
 FILE="unikernel_kvmfc-x86_64_local_align_aslr.dbg"
+# Same as aslr.JSON_MAPS_FILE (this script also runs outside of the package)
 JSON_MAPS_FILE='ind_map.json'
 PAGE_SIZE=0x1000
+CLASSIFIERS=["operands", "regex"]
+
+# ELF64 little endian structures (in-place rewriting)
+EHDR=struct.Struct("<16sHHIQQQIHHHHHH")
+SHDR=struct.Struct("<IIQQQQIIQQ")
+SYM=struct.Struct("<IBBHQQ")
+SHT_SYMTAB=2
+SHT_NOBITS=8
+
+# jmp/call rel32 (opcode and displacement)
+JMP=struct.Struct("<Bi")
+NOPS=b"\x90" * 16
 
 def printv(*args, **kwargs):
+    # The arguments are formatted by the caller: only call it under "if verbose:" on hot paths
     if verbose:
         print(*args, **kwargs)
 
+def hex_bytes(bt):
+    return bt.hex(' ')
+
+class Trace:
+    # One JSON object per rewritten instruction, streamed to a file (or kept by a worker process)
+    def __init__(self, f=None):
+        self.f = f
+        self.records = list()
+
+    def add(self, record):
+        if self.f is not None:
+            self.f.write(json.dumps(record) + "\n")
+        else:
+            self.records.append(record)
+
+    def flush_records(self):
+        records = self.records
+        self.records = list()
+        return records
+
 def toSigned(signed_int):
     return signed_int + 2**32
 
@@ -60,10 +101,11 @@ class Unikernel:
     def __init__(self, name):
         self.name = name
         self.binary = None
+        self.mmap = None
         self.segments = list()
         self.sections = list()
-        self.symbols = list()
-        self.map_symbols = defaultdict(list)
+        self.section_map = dict()
+        self.index = None
         self.dump = None
         self.maps_size_libs = dict()
 
@@ -92,30 +134,50 @@ class Section:
         return self.virtual_address
 
 class sectionInd:
-    def __init__(self, addr):
-        self.IndInst = dict()
+    def __init__(self, addr, size=PAGE_SIZE, record=False):
+        # Bytes of each trampoline instruction by address (only kept for diagnostics)
+        self.IndInst = dict() if record else None
         self.start_addr = addr
         self.addr = addr
-        self.bt = bytearray()
+        # Preallocated buffer (size of the .ind section), only the first self.length bytes are used
+        self.buf = bytearray(max(size, PAGE_SIZE))
+        self.length = 0
+
+    def reserve(self, n):
+        if self.length + n > len(self.buf):
+            self.buf.extend(bytes(max(len(self.buf), n)))
+
+    def write(self, barray):
+        n = len(barray)
+        self.reserve(n)
+        self.buf[self.length:self.length+n] = barray
+        if self.IndInst is not None:
+            self.IndInst[self.addr] = bytes(barray)
+        self.length += n
+
+    def content(self):
+        del self.buf[self.length:]
+        return self.buf
 
     def addInsBytes(self, op, addr , offset=0x0):
-        barray = bytearray()
         diff = -(self.addr-addr)-offset
 
-        printv("(addInsBytes): 0x{:x}- 0x{:x}= 0x{:x} -> {:x}".format(self.addr, addr, diff, toSigned(diff)))
-        barray.append(op)
-        barray.extend(diff.to_bytes(4, byteorder = 'little', signed=True))
-
-        self.IndInst[self.addr]=barray
+        if verbose:
+            printv("(addInsBytes): 0x{:x}- 0x{:x}= 0x{:x} -> {:x}".format(self.addr, addr, diff, toSigned(diff)))
+        self.reserve(5)
+        JMP.pack_into(self.buf, self.length, op, diff)
+        if self.IndInst is not None:
+            self.IndInst[self.addr] = bytes(self.buf[self.length:self.length+5])
         self.addr += 5
-        self.bt.extend(barray)
+        self.length += 5
 
     def optimize_addrs(self):
 
-        printv("(optimize_addrs): Addr before: {:x} - Addr now: {:x}".format(self.addr, self.addr-5))
+        if verbose:
+            printv("(optimize_addrs): Addr before: {:x} - Addr now: {:x}".format(self.addr, self.addr-5))
 
         self.addr -= 5 #remove the previous jump
-        self.bt = self.bt[:-5] #remove the previous jump
+        self.length -= 5 #remove the previous jump (overwritten by the next trampoline)
 
     def addIndBytes(self, next_addr, current_addr, ins_bytes, optimized_suit):
 
@@ -136,15 +198,16 @@ class sectionInd:
         elif op == 0xba or 0xbe or 0xbf:
 
 
-            self.bt.extend(ins_bytes)
+            self.write(ins_bytes)
             self.addr += 5
             self.addInsBytes(0xe9, current_addr)
         else:
-            printv("(addIndBytes) 0x{:x} :".format(op), end=" ")
-            printv(ins_bytes)
+            if verbose:
+                printv("(addIndBytes) 0x{:x} :".format(op), end=" ")
+                printv(ins_bytes)
 
-        if len(self.bt) > 0 and len(self.bt) % PAGE_SIZE == 0:
-            printv("(addIndBytes) EXCEED SIZE {}".format(len(self.bt)))
+        if verbose and self.length > 0 and self.length % PAGE_SIZE == 0:
+            printv("(addIndBytes) EXCEED SIZE {}".format(self.length))
 
         return self.addr
 
@@ -153,31 +216,25 @@ class sectionInd:
         if optimized_suit > 0:
             self.optimize_addrs()
 
-        self.bt.extend(ins_bytes)
+        self.write(ins_bytes)
         self.addr += len(ins_bytes)
         self.addInsBytes(0xe9, current_addr)
 
-        if len(self.bt) > 0 and len(self.bt) % PAGE_SIZE == 0:
-            printv("(addIndBytesBigger) EXCEED SIZE {}".format(len(self.bt)))
+        if verbose and self.length > 0 and self.length % PAGE_SIZE == 0:
+            printv("(addIndBytesBigger) EXCEED SIZE {}".format(self.length))
 
     def debug(self, barray):
         md = Cs(CS_ARCH_X86, CS_MODE_64)
         md.detail = True
         for new_ins in md.disasm(barray, self.addr):
-            printv("(addIndBytesBigger) Other: 0x{:x} {:<32}{:<20}{:<32}\n".format(new_ins.address, ' '.join(re.findall('..',new_ins.bytes.hex())), new_ins.mnemonic, new_ins.op_str), end="")
+            printv("(addIndBytesBigger) Other: 0x{:x} {:<32}{:<20}{:<32}\n".format(new_ins.address, hex_bytes(new_ins.bytes), new_ins.mnemonic, new_ins.op_str), end="")
 
     def addIndBytesBiggerRip(self, ins, optimized_suit):
 
         if optimized_suit > 0:
             self.optimize_addrs()
 
-        x = re.search("rip\s+(?P<op>\+|\-)\s+(?P<addr>0x[A-Fa-f0-9]{2,})", ins.op_str)
-        if x != None:
-            op = x.group("op")
-            if op == "+":
-                addr = ins.address + int(x.group("addr"), 16)
-            elif op == "-":
-                addr = ins.address - int(x.group("addr"), 16)
+        addr = ins.address + rip_disp(ins)
 
         # Compute the (old) offset from rip
         previous_offset = addr-ins.address
@@ -196,53 +253,119 @@ class sectionInd:
             barray.extend(reminder)
 
         # Add the jump instruction
-        self.IndInst[self.addr]=barray
+        self.write(barray)
         self.addr += len(ins.bytes)
-        self.bt.extend(barray)
         self.addInsBytes(0xe9, ins.address)
 
-        if len(self.bt) > 0 and len(self.bt) % PAGE_SIZE == 0:
-            printv("(addIndBytesBiggerRip) EXCEED SIZE {}".format(len(self.bt)))
+        if verbose and self.length > 0 and self.length % PAGE_SIZE == 0:
+            printv("(addIndBytesBiggerRip) EXCEED SIZE {}".format(self.length))
 
-class Symbol:
-    def __init__(self, address, name, info):
-        self.address = address
-        self.name = name
-        self.info = info
+class AddrIndex:
+    # Sorted index of the sections ranges and of the symbols addresses (bisect lookups)
+    def __init__(self, sections):
+
+        # Union of the closed ranges [start, end] of the (allocated) sections
+        self.starts = list()
+        self.ends = list()
+        for start, end in sorted((s.virtual_address, s.end) for s in sections if s.virtual_address != 0):
+            if len(self.ends) > 0 and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+        # Names of the sections covering each elementary interval [bounds[k], bounds[k+1]]
+        self.bounds = sorted(set([s.virtual_address for s in sections] + [s.end for s in sections]))
+        self.covers = [list() for _ in self.bounds]
+        for s in sections:
+            for k in range(bisect_left(self.bounds, s.virtual_address), bisect_left(self.bounds, s.end)):
+                self.covers[k].append(s.name)
+
+        # Symbols are loaded on demand (see get_symbols)
+        self.sym_addrs = None
+        self.sym_names = None
+
+    def load_symbols(self, addrs, names):
+        # Parallel arrays sorted by address
+        order = sorted(range(len(addrs)), key=addrs.__getitem__)
+        self.sym_addrs = array('Q', (addrs[i] for i in order))
+        self.sym_names = [names[i] for i in order]
+
+    def in_section(self, addr):
+        i = bisect_right(self.starts, addr) - 1
+        return i >= 0 and addr <= self.ends[i]
+
+    def sections_at(self, addr):
+        # Sections such as start < addr < end
+        k = bisect_right(self.bounds, addr) - 1
+        if k < 0 or k >= len(self.bounds) - 1:
+            return list()
+        if addr == self.bounds[k]:
+            if k == 0:
+                return list()
+            return [name for name in self.covers[k] if name in self.covers[k-1]]
+        return self.covers[k]
+
+    def sections_containing(self, addr):
+        # Sections such as start <= addr < end
+        k = bisect_right(self.bounds, addr) - 1
+        if k < 0:
+            return list()
+        return list(self.covers[k])
+
+    def symbols_at(self, addr):
+        i = bisect_left(self.sym_addrs, addr)
+        j = bisect_right(self.sym_addrs, addr, lo=i)
+        return self.sym_names[i:j]
 
 class Instruction:
     def __init__(self, address, mnemonic, op_str, _bytes):
         self.address = address
         self.mnemonic = mnemonic
         self.op_str = op_str
-        self.bytes = self.cut(hexlify(_bytes).decode())
+        self.raw = _bytes
+        self._bytes = None
+
+    @property
+    def bytes(self):
+        # Hex dump (only formatted when it is displayed)
+        if self._bytes is None:
+            self._bytes = self.cut(hexlify(self.raw).decode())
+        return self._bytes
 
     def cut(self, line, n=2):
         return ' '.join([line[i:i+n] for i in range(0, len(line), n)])
 
 def display_functions(ins, uk, int_addr, m=None):
 
-    if int_addr in uk.map_symbols:
+    if not verbose:
+        return
+
+    if uk.index.sym_addrs is None:
+        get_symbols(uk)
+
+    names = uk.index.symbols_at(int_addr)
+    if len(names) > 0:
         printv(">> FCT: ", end="")
-        for s in uk.map_symbols[int_addr]:
-            printv(s.name, end="")
+        for name in names:
+            printv(name, end="")
         printv("")
-    printv("0x{:x} {:<32}{:<20}{:<32}".format(ins.address, ' '.join(re.findall('..',ins.bytes.hex())), ins.mnemonic, ins.op_str), end="")
+    printv("0x{:x} {:<32}{:<20}{:<32}".format(ins.address, hex_bytes(ins.bytes), ins.mnemonic, ins.op_str), end="")
 
     if m != None:
         found = False
         int_addr = int(m, 16)
-        if int_addr in uk.map_symbols:
+        names = uk.index.symbols_at(int_addr)
+        if len(names) > 0:
             # Call to a function
-            for s in uk.map_symbols[int_addr]:
-                printv("\t{} --> call to {}".format(m, s.name))
+            for name in names:
+                printv("\t{} --> call to {}".format(m, name))
                 found = True
         else:
             # Another section
-            for s in uk.sections:
-                if s.virtual_address < int_addr < s.end:
-                    printv("\t{} --> refer to {}".format(m, s.name))
-                    found = True
+            for name in uk.index.sections_at(int_addr):
+                printv("\t{} --> refer to {}".format(m, name))
+                found = True
 
         if not found:
             printv("")
@@ -272,139 +395,309 @@ def check_addr(uk, addrInt, current_section, ins):
         return False
 
     # Check if it is used addres from other section
-    for s in uk.sections:
-        if s.virtual_address != 0 and s.virtual_address <= addrInt <= s.end:
-            return True
+    return uk.index.in_section(addrInt)
 
-    return False
+def rip_disp(ins):
+    for op in ins.operands:
+        if op.type == X86_OP_MEM and op.mem.base == X86_REG_RIP:
+            return op.mem.disp
+    return None
+
+def classify_regex(uk, ins, s):
+
+    x = re.search("0x[A-Fa-f0-9]{4,}", ins.op_str)
+    if x == None:
+        return None, None
+
+    used_addr = x.group()
+    if used_addr.lower() == "0xffffffff":
+        return None, None
 
-def process_instructions(uk, ins, s, used_addr, optimized_suit):
+    # display_functions(ins, uk, int(ins.address), used_addr)
     addrInt= int(used_addr, 16)
     if "rip" not in ins.op_str and len(used_addr) < 8:
-        return None
+        return None, None
 
     if addrInt == 0xffffff or len(used_addr) > 8:
-        return None
+        return None, None
 
     # Check range of address and addressing mode
     if check_addr(uk, addrInt, s, ins) == False:
-        printv("(process_instructions) 0x{:x} {:<32}{:<20}{:<32}\n".format(ins.address, ' '.join(re.findall('..',ins.bytes.hex())), ins.mnemonic, ins.op_str), end="")
-        return None
+        if verbose:
+            printv("(process_instructions) 0x{:x} {:<32}{:<20}{:<32}\n".format(ins.address, hex_bytes(ins.bytes), ins.mnemonic, ins.op_str), end="")
+        return None, None
+
+    if len(ins.bytes) < 5:
+        return None, None
+
+    if "rip" in ins.op_str:
+        return addrInt, "rip"
+    elif len(ins.bytes) == 5 and ins.bytes[0] in [0xe8, 0xe9]:
+        return addrInt, "branch"
+    return addrInt, "absolute"
+
+def classify_operands(uk, ins, s):
+
+    # A jmp (5 bytes) is required to reach the indirection section
+    if len(ins.bytes) < 5:
+        return None, None
+
+    for op in ins.operands:
+        if op.type == X86_OP_MEM and op.mem.base == X86_REG_RIP:
+            # Relative to rip: only a reference to another section depends on the layout
+            target = ins.address + len(ins.bytes) + op.mem.disp
+            if len(ins.bytes) > 5 and not s.virtual_address <= target < s.end and uk.index.in_section(target):
+                return target, "rip"
+            return None, None
+        elif op.type == X86_OP_MEM:
+            # Absolute address used as displacement (alone or with a base/index register)
+            if uk.index.in_section(op.mem.disp & 0xffffffffffffffff):
+                return op.mem.disp & 0xffffffffffffffff, "absolute"
+        elif op.type == X86_OP_IMM:
+            if ins.group(CS_GRP_JUMP) or ins.group(CS_GRP_CALL):
+                # Relative call/jmp (rel32) to another section
+                target = op.imm
+                if ins.bytes[0] in [0xe8, 0xe9] and not s.virtual_address <= target < s.end and uk.index.in_section(target):
+                    return target, "branch"
+                return None, None
+            elif uk.index.in_section(op.imm & 0xffffffffffffffff):
+                # Absolute address used as immediate
+                return op.imm & 0xffffffffffffffff, "absolute"
+
+    return None, None
+
+def process_instructions(uk, ins, s, addrInt, optimized_suit, text):
+
+    # The jmp to the trampoline is written over the instruction in the text buffer
+    size = len(ins.bytes)
+    if size < 5:
+        return False
 
-    if len(ins.bytes) == 5:
+    addr = s.sectionInd.addr
+    if size == 5:
         # Call or jmp instructions
-        printv("(process_instructions) Instruction: 0x{:x} {:<32}{:<20}{:<32}\n".format(ins.address, ' '.join(re.findall('..',ins.bytes.hex())), ins.mnemonic, ins.op_str), end="")
-        addr = s.sectionInd.addr
+        if verbose:
+            printv("(process_instructions) Instruction: 0x{:x} {:<32}{:<20}{:<32}\n".format(ins.address, hex_bytes(ins.bytes), ins.mnemonic, ins.op_str), end="")
         s.sectionInd.addIndBytes(addrInt, ins.address, ins.bytes, optimized_suit)
-        barray = bytearray()
-        barray.append(0xe9)
-        if optimized_suit > 0:
-            diff = addr - ins.address - 0x5 - 0x5
-        else:
-            diff = addr - ins.address - 0x5
-        barray.extend(diff.to_bytes(4, byteorder = 'little', signed=True))
-    elif len(ins.bytes) > 5:
-
+    elif rip_disp(ins) is not None:
         # Complex instructions
-        addr = s.sectionInd.addr
-        if "rip" in ins.op_str:
-            s.sectionInd.addIndBytesBiggerRip(ins, optimized_suit)
-        else:
-            s.sectionInd.addIndBytesBigger(addrInt, ins.address, ins.bytes, optimized_suit)
-
-        # Add the jmp in the current address
-        barray = bytearray()
-        barray.append(0xe9)
-        if optimized_suit > 0:
-            diff = addr - ins.address - 0x5 - 0x5
-        else:
-            diff = addr - ins.address - 0x5
-
-
-        barray.extend(diff.to_bytes(4, byteorder = 'little', signed=True))
-
-        # padding with Nops
-        for _ in range(len(ins.bytes) - 5):
-            barray.append(0x90)
+        s.sectionInd.addIndBytesBiggerRip(ins, optimized_suit)
     else:
-        return None
-
-    return barray
+        s.sectionInd.addIndBytesBigger(addrInt, ins.address, ins.bytes, optimized_suit)
 
-def disassemble(uk, s):
+    if optimized_suit > 0:
+        diff = addr - ins.address - 0x5 - 0x5
+    else:
+        diff = addr - ins.address - 0x5
+
+    offset = ins.address - s.virtual_address
+    JMP.pack_into(text, offset, 0xe9, diff)
+    # padding with Nops
+    text[offset+5:offset+size] = NOPS[:size-5]
+    return True
+
+def trace_instruction(uk, s, ins, addrInt, kind, rewritten, optimized_suit, ind_length, text):
+
+    # The trampoline of an instruction which follows another one starts on the removed jump back
+    ind = s.sectionInd
+    start = ind_length - 5 if rewritten and optimized_suit > 0 else ind_length
+    offset = ins.address - s.virtual_address
+    trace.add({
+        "section": s.name,
+        "address": "0x{:x}".format(ins.address),
+        "instruction": "{} {}".format(ins.mnemonic, ins.op_str),
+        "original": hex_bytes(ins.bytes),
+        "new": hex_bytes(text[offset:offset+len(ins.bytes)]) if rewritten else None,
+        "trampoline": "0x{:x}".format(ind.start_addr + start) if rewritten else None,
+        "ind": hex_bytes(ind.buf[start:ind.length]) if rewritten else None,
+        "target": "0x{:x}".format(addrInt),
+        "target_sections": uk.index.sections_containing(addrInt),
+        "reason": kind if rewritten else "too short for a jmp ({})".format(kind),
+        "suit": optimized_suit if rewritten else 0
+    })
+
+def disassemble_section(uk, s, ind_addr, classifier=CLASSIFIERS[0], compare=False, ind_size=PAGE_SIZE):
 
     md = Cs(CS_ARCH_X86, CS_MODE_64)
     md.detail = True
 
-    nameInd = s.name.replace(".text", ".ind")
-
+    if classifier == "regex":
+        classify, other = classify_regex, classify_operands
+    else:
+        classify, other = classify_operands, classify_regex
 
     # Add Ind section to current section
-    s.sectionInd = sectionInd(uk.binary.get_section(nameInd).virtual_address)
-    bt = bytearray()
+    s.sectionInd = sectionInd(ind_addr, ind_size, verbose)
+    # Only the rewritten instructions are patched in the copy of the section
+    bt = bytearray(s.content)
+    counters = Counter()
     optimized_suit = 0 # Incremented if several instructions are follow up (optimize)
+    n_ins = n_rewritten = n_trampolines = 0
     for ins in md.disasm(s.content, s.virtual_address):
-        int_addr = int(ins.address)
-
-        x = re.search("0x[A-Fa-f0-9]{4,}", ins.op_str)
-        if x != None:
-            m = x.group()
-            if m.lower() != "0xffffffff":
-                # display_functions(ins, uk, int_addr, m)
-                ind_bytes = process_instructions(uk, ins, s, m, optimized_suit)
-                if ind_bytes:
-                    bt.extend(ind_bytes)
-                    optimized_suit += 1
-                else:
-                    bt.extend(ins.bytes)
-                    optimized_suit = 0
-            else:
-                bt.extend(ins.bytes)
-                optimized_suit = 0
+
+        addrInt, kind = classify(uk, ins, s)
+        if compare:
+            # Classify with both approaches (report only)
+            _, other_kind = other(uk, ins, s)
+            if kind is not None:
+                counters["{}.{}".format(classifier, kind)] += 1
+            if other_kind is not None:
+                counters["{}.{}".format(other.__name__.replace("classify_", ""), other_kind)] += 1
+            if kind is not None and other_kind is not None:
+                counters["both"] += 1
+
+        rewritten = False
+        if addrInt is not None:
+            ind_length = s.sectionInd.length
+            rewritten = process_instructions(uk, ins, s, addrInt, optimized_suit, bt)
+            if trace is not None:
+                trace_instruction(uk, s, ins, addrInt, kind, rewritten, optimized_suit, ind_length, bt)
+
+        n_ins += 1
+        if rewritten:
+            n_rewritten += 1
+            if optimized_suit == 0:
+                # A suit of rewritten instructions shares one trampoline (single jump back)
+                n_trampolines += 1
+            optimized_suit += 1
         else:
-                # display_functions(ins, uk, int_addr)
-                bt.extend(ins.bytes)
-                optimized_suit = 0
+            optimized_suit = 0
+
+    counters["instructions"] += n_ins
+    counters["rewritten"] += n_rewritten
+    counters["trampolines"] += n_trampolines
+    return bt, s.sectionInd.content(), counters
 
-    uk.binary.get_section(s.name).content = bt
-    uk.binary.get_section(nameInd).content = s.sectionInd.bt
+def report_classifiers(counters):
+
+    total = dict()
+    for name in CLASSIFIERS:
+        total[name] = sum(v for k, v in counters.items() if k.startswith(name + "."))
+
+    print("Classified instructions (both: {})".format(counters["both"]))
+    for name in CLASSIFIERS:
+        kinds = ", ".join("{}: {}".format(kind, counters["{}.{}".format(name, kind)]) for kind in ["branch", "rip", "absolute"])
+        print("  {:<10} {:>8} ({}) - only this classifier: {}".format(name, total[name], kinds, total[name] - counters["both"]))
+
+def check_sections(uk, s, bt, ind_bt):
+
+    # Sizes are fixed by the link (in place)
+    nameInd = s.name.replace(".text", ".ind")
+    ind = uk.section_map[nameInd]
+    if len(bt) != s.size:
+        raise ValueError("{}: 0x{:x} bytes for a section of 0x{:x}".format(s.name, len(bt), s.size))
+    if len(ind_bt) > ind.size or (len(ind_bt) > 0 and ind.sh_type == SHT_NOBITS):
+        raise ValueError("{}: overflow (0x{:x} bytes for 0x{:x})".format(nameInd, len(ind_bt), ind.size))
+
+def update_sections(uk, s, bt, ind_bt):
+
+    nameInd = s.name.replace(".text", ".ind")
+    if uk.mmap is not None:
+        # Checked by check_sections: write the new bytes at their file offsets
+        ind = uk.section_map[nameInd]
+        uk.mmap[s.offset:s.offset+len(bt)] = bt
+        uk.mmap[ind.offset:ind.offset+len(ind_bt)] = ind_bt
+    else:
+        uk.binary.get_section(s.name).content = bt
+        uk.binary.get_section(nameInd).content = ind_bt
     
-    len_ind=len(s.sectionInd.bt)
+    len_ind=len(ind_bt)
     if len_ind > 0:
-        if s.name in uk.maps_size_libs:
-            old_value = int(uk.maps_size_libs[s.name], 16)
-            if len_ind > old_value:
-                uk.maps_size_libs[s.name] = "0x{:x}".format(len_ind)
-                print("Update {} with new value 0x{:x} (old: 0x{:x})".format(s.name,len_ind,old_value))
-        else:    
-            uk.maps_size_libs[s.name] = "0x{:x}".format(len_ind)
-    
-    return
-
-def process_symbols(uk, lines):
-    for l in lines:
-        group = l.split()
-        if len(group) == 3:
-            symbol = Symbol(int(group[0],16), group[2], group[1])
-            uk.map_symbols[symbol.address].append(symbol)
-            uk.symbols.append(symbol)
-            printv("{} - 0x{:x} - ({} bytes)".format(symbol.name, symbol.address, symbol.info))
-        else:
-            printv("[WARNING] Ignoring symbol {}".format(l))
+        uk.maps_size_libs[s.name] = "0x{:x}".format(len_ind)
+
+def disassemble(uk, s, classifier=CLASSIFIERS[0], compare=False):
+
+    ind = uk.section_map[s.name.replace(".text", ".ind")]
+    return disassemble_section(uk, s, ind.virtual_address, classifier, compare, ind.size)
+
+# Unikernel of a worker process (section-parallel disassembly)
+worker_uk = None
+
+def init_worker(name, index, v, tracing):
+    global verbose, trace, worker_uk
+    verbose = v
+    # The records are sent back with the section (written in order by the parent)
+    trace = Trace() if tracing else None
+    worker_uk = Unikernel(name)
+    worker_uk.index = index
+
+def disassemble_worker(s, ind_addr, ind_size, classifier, compare):
+    result = disassemble_section(worker_uk, s, ind_addr, classifier, compare, ind_size)
+    return result, trace.flush_records() if trace is not None else None
+
+def disassemble_parallel(uk, sections, jobs, classifier=CLASSIFIERS[0], compare=False):
+
+    # Workers only need the index of the sections (not their content)
+    inds = [uk.section_map[s.name.replace(".text", ".ind")] for s in sections]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(uk.name, uk.index, verbose, trace is not None)) as executor:
+        results = list(executor.map(disassemble_worker, sections, [i.virtual_address for i in inds], [i.size for i in inds], repeat(classifier), repeat(compare)))
+
+    # New contents in the order of the sections
+    contents = list()
+    for (result, records) in results:
+        contents.append(result)
+        for record in records or list():
+            trace.add(record)
+    return contents
 
 def get_symbols(uk):
-    p = run( ['nm', '--no-demangle',uk.name], stdout=PIPE, stderr=PIPE, universal_newlines=True)
 
-    if p.returncode == 0 and len(p.stdout) > 0:
-        process_symbols(uk, p.stdout.splitlines())
-    elif len(p.stderr) > 0:
-        printv("[WARNING] stderr:", p.stderr)
-    else:
-        printv("[ERROR] Failure to run NM")
-        sys.exit(1)
+    # Read the symbol table of the parsed binary (defined symbols only)
+    addrs = list()
+    names = list()
+    if uk.binary is not None:
+        for symbol in uk.binary.symbols:
+            if len(symbol.name) > 0 and symbol.shndx != 0:
+                addrs.append(symbol.value)
+                names.append(symbol.name)
+    elif uk.mmap is not None:
+        for s in uk.sections:
+            if s.sh_type != SHT_SYMTAB:
+                continue
+            strtab = uk.sections[s.link]
+            for off in range(s.offset, s.offset + s.size, SYM.size):
+                st_name, _, _, st_shndx, st_value, _ = SYM.unpack_from(uk.mmap, off)
+                if st_name != 0 and st_shndx != 0:
+                    addrs.append(st_value)
+                    names.append(c_string(uk.mmap, strtab.offset + st_name))
+    uk.index.load_symbols(addrs, names)
 
 def update_uk(uk, filename):
-    uk.binary.write(filename)
+    if uk.mmap is not None:
+        uk.mmap.flush()
+        uk.mmap.close()
+        uk.mmap = None
+    else:
+        uk.binary.write(filename)
+
+def c_string(m, offset):
+    end = m.find(b"\0", offset)
+    return m[offset:end if end >= 0 else len(m)].decode("utf-8", "replace")
+
+def read_section_table(m):
+    # (name, type, addr, offset, size, addralign, link) of each section header
+    ident, _, _, _, _, _, e_shoff, _, _, _, _, e_shentsize, e_shnum, e_shstrndx = EHDR.unpack_from(m, 0)
+    if ident[:4] != b"\x7fELF" or ident[4] != 2 or ident[5] != 1 or e_shentsize != SHDR.size:
+        raise ValueError("not an ELF64 little endian file")
+    headers = [SHDR.unpack_from(m, e_shoff + n * SHDR.size) for n in range(e_shnum)]
+    strtab = headers[e_shstrndx][4]
+    return [(c_string(m, strtab + h[0]), h[1], h[3], h[4], h[5], h[8], h[6]) for h in headers]
+
+def process_file_mmap(uk):
+
+    # Only the section headers are decoded and only the .text.<lib> are copied
+    with open(uk.name, "r+b") as f:
+        uk.mmap = mmap.mmap(f.fileno(), 0)
+
+    for name, sh_type, addr, offset, size, alignment, link in read_section_table(uk.mmap):
+        uk_sect = Section(name, addr, offset, size, alignment)
+        uk_sect.sh_type = sh_type
+        uk_sect.link = link
+        if name.startswith(".text.") and sh_type != SHT_NOBITS:
+            uk_sect.content = uk.mmap[offset:offset+size]
+        uk.sections.append(uk_sect)
+        uk.section_map.setdefault(name, uk_sect)
 
 def process_file(uk):
 
@@ -419,33 +712,106 @@ def process_file(uk):
         bt.extend(section.content)
         uk_sect.content = bt
         uk.sections.append(uk_sect)
+        uk.section_map.setdefault(section.name, uk_sect)
+
+def load_maps_size(json_file):
+    if os.path.isfile(json_file):
+        with open(json_file, 'r') as json_data:
+            return json.load(json_data)
+    return dict()
 
-def rewrite_uk(file, json_file, v):
+def save_maps_size(json_file, maps_size_libs):
+    with open(json_file, 'w') as fp:
+        json.dump(maps_size_libs, fp, indent=4)
+
+def update_maps_size(maps_size_libs, sizes):
+    # Keep the maximum size of each indirection section
+    for name, value in sizes.items():
+        len_ind = int(value, 16)
+        if name in maps_size_libs:
+            old_value = int(maps_size_libs[name], 16)
+            if len_ind > old_value:
+                maps_size_libs[name] = "0x{:x}".format(len_ind)
+                print("Update {} with new value 0x{:x} (old: 0x{:x})".format(name,len_ind,old_value))
+        else:
+            maps_size_libs[name] = "0x{:x}".format(len_ind)
+
+def rewrite_binary(file, v, jobs=1, classifier=CLASSIFIERS[0], compare=False, inplace=False, trace_file=None):
     
     global verbose
     
     verbose = False
     if v:
         verbose=True
-        
+
+    if trace_file is None:
+        return rewrite_file(file, jobs, classifier, compare, inplace)
+
+    global trace
+    with open(trace_file, "w") as f:
+        trace = Trace(f)
+        try:
+            return rewrite_file(file, jobs, classifier, compare, inplace)
+        finally:
+            trace = None
+
+def rewrite_file(file, jobs, classifier, compare, inplace):
+
     uk = Unikernel(file)
-    process_file(uk)
-    get_symbols(uk)
-    
-    if os.path.isfile(json_file):
-        with open(json_file, 'r') as json_data:
-            uk.maps_size_libs = json.load(json_data)
-    
-    for _, s in enumerate(uk.sections):
-        if s.name.startswith(".text.") and "app" not in s.name:
-            printv("Update " + s.name)
-            disassemble(uk, s)
-        elif s.name.startswith(".text."):
-            print("- Ignore " + s.name)
-
-    update_uk(uk, file)
-    with open(json_file, 'w') as fp:
-        json.dump(uk.maps_size_libs, fp, indent=4)
+    try:
+        if inplace:
+            process_file_mmap(uk)
+        else:
+            process_file(uk)
+        uk.index = AddrIndex(uk.sections)
+        if verbose:
+            # Symbols are only used by diagnostics (loaded before workers are forked)
+            get_symbols(uk)
+
+        sections = list()
+        for _, s in enumerate(uk.sections):
+            if s.name.startswith(".text.") and "app" not in s.name:
+                printv("Update " + s.name)
+                sections.append(s)
+            elif s.name.startswith(".text."):
+                print("- Ignore " + s.name)
+
+        # Each .text.<lib> has its own .ind.<lib> and can be rewritten independently
+        if jobs > 1 and len(sections) > 1:
+            contents = disassemble_parallel(uk, sections, jobs, classifier, compare)
+        else:
+            contents = [disassemble(uk, s, classifier, compare) for s in sections]
+
+        if uk.mmap is not None:
+            # All the sections are checked before the first write (the binary is left unchanged on error)
+            for s, (bt, ind_bt, _) in zip(sections, contents):
+                check_sections(uk, s, bt, ind_bt)
+
+        counters = Counter()
+        for s, (bt, ind_bt, c) in zip(sections, contents):
+            update_sections(uk, s, bt, ind_bt)
+            counters.update(c)
+
+        if compare:
+            report_classifiers(counters)
+
+        update_uk(uk, file)
+    finally:
+        if uk.mmap is not None:
+            # Error before update_uk
+            uk.mmap.close()
+            uk.mmap = None
+
+    # Size of each indirection section of this binary and the counters of the rewriting
+    return uk.maps_size_libs, counters
+
+def rewrite_uk(file, json_file, v, jobs=1, classifier=CLASSIFIERS[0], compare=False, inplace=False, trace_file=None):
+
+    maps_size_libs = load_maps_size(json_file)
+    sizes, counters = rewrite_binary(file, v, jobs, classifier, compare, inplace, trace_file)
+    update_maps_size(maps_size_libs, sizes)
+    save_maps_size(json_file, maps_size_libs)
+    return counters
     
 def main():
 
@@ -454,9 +820,14 @@ def main():
                         default=os.path.join(WORKDIR, FILE))
     parser.add_argument('-v', '--verbose',  help='verbose mode', type=bool,  default=VERBOSE)
     parser.add_argument('-j', '--json',     help="Path to the json file which contains size (ind)", type=str, default=JSON_MAPS_FILE)
+    parser.add_argument('--jobs',           help="Number of sections rewritten in parallel", type=int, default=1)
+    parser.add_argument('--classifier',     help="Classifier of the instructions to rewrite", choices=CLASSIFIERS, default=CLASSIFIERS[0])
+    parser.add_argument('--compare',        help="Report how many instructions each classifier selects", action='store_true')
+    parser.add_argument('--inplace',        help="Patch .text.<lib> and .ind.<lib> in the mapped file (instead of writing it again with lief)", action='store_true')
+    parser.add_argument('--trace',          help="Write the rewritten instructions to this file (JSON lines: address, bytes, trampoline, reason)", type=str)
     args = parser.parse_args()
 
-    rewrite_uk(args.file, args.json, args.verbose)
+    rewrite_uk(args.file, args.json, args.verbose, args.jobs, args.classifier, args.compare, args.inplace, args.trace)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
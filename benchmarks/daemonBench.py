@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from fleetGenerator import generate_fleet
+from fleetDaemon import request
+
+ALIGNER = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "aligner.py")
+
+def aligner(workspace, uks, *options):
+    # Fresh process (as started by a deployment): no relink and no copy of the objects
+    cmd = [sys.executable, ALIGNER, "-w", workspace, "-u"] + uks + ["-r", "0", "-o", "0", "-v", "0"] + list(options)
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True)
+    return time.perf_counter() - start
+
+def timed_request(sock, req):
+    start = time.perf_counter()
+    response = request(sock, req)
+    if not response["ok"]:
+        raise RuntimeError("{}: {}".format(req, response["error"]))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of a deployment: fresh aligner process versus the daemon (--daemon)')
+    parser.add_argument('-w', '--workspace', help='Workspace Directory (default: a temporary directory)', type=str, default=None)
+    parser.add_argument('-n', '--uks',       help='Number of unikernels of the fleet', type=int, default=256)
+    parser.add_argument('--libs',            help='Number of libs in the pool', type=int, default=256)
+    parser.add_argument('--per_uk',          help='Number of libs of each unikernel (without its app)', type=int, default=24)
+    parser.add_argument('--common',          help='Number of libs used by all the unikernels', type=int, default=6)
+    parser.add_argument('--reserve',         help='Bytes reserved for the unikernels added later', type=int, default=0x400000)
+    args = parser.parse_args()
+
+    workspace = args.workspace or tempfile.mkdtemp(prefix="spacer-daemon-")
+    workspace = os.path.join(workspace, "")
+    sock = os.path.join(workspace, "aligner.sock")
+    daemon = None
+    try:
+        uks = generate_fleet(workspace, args.uks + 1, args.libs, args.per_uk, args.common)
+        fleet, new = uks[:-1], uks[-1]
+        state = os.path.join(workspace, "fleet.json")
+
+        results = list()
+        results.append(("process: full alignment", aligner(workspace, fleet, "--state", state, "--reserve", str(args.reserve))))
+        results.append(("process: --add", aligner(workspace, fleet, "--state", state, "--add", new)))
+
+        # The daemon scans the fleet once, then only reads the modified objects
+        os.remove(state)
+        daemon = subprocess.Popen([sys.executable, ALIGNER, "-w", workspace, "-u"] + uks + ["-r", "0", "-o", "0", "-v", "0",
+                                   "--state", state, "--reserve", str(args.reserve), "--daemon", sock, "--watch", "0"])
+        while not os.path.exists(sock):
+            if daemon.poll() is not None:
+                raise RuntimeError("the daemon exited with {}".format(daemon.returncode))
+            time.sleep(0.05)
+        request(sock, {"op": "remove", "name": new})
+        results.append(("daemon: realign", timed_request(sock, {"op": "realign"})))
+        results.append(("daemon: add", timed_request(sock, {"op": "add", "name": new})))
+        results.append(("daemon: realign", timed_request(sock, {"op": "realign"})))
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+        if args.workspace is None:
+            shutil.rmtree(workspace)
+
+    print("Fleet of {} unikernels (+1 added)".format(args.uks))
+    for name, elapsed in results:
+        print("  {:<26} {:>8.3f}s".format(name, elapsed))
+
+if __name__ == '__main__':
+    main()
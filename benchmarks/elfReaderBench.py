@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from unikernels import read_sections, SEC_NAME, OBJ_EXT
+
+BACKENDS = ["mmap", "pyelftools"]
+
+def find_objects(paths):
+    objs = list()
+    for p in paths:
+        if os.path.isfile(p):
+            objs.append(p)
+            continue
+        for root, _, files in os.walk(p):
+            objs.extend(os.path.join(root, f) for f in sorted(files) if f.endswith(OBJ_EXT))
+    return objs
+
+def bench(objs, backend, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        infos = [read_sections(o, SEC_NAME, backend) for o in objs]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, infos
+
+def main():
+    parser = argparse.ArgumentParser(description='Objects/s of the ELF section readers')
+    parser.add_argument('paths',           help='Object files or folders (e.g. apps/*/build)', nargs='+')
+    parser.add_argument('-r', '--repeat',  help='Number of runs (the best one is kept)', type=int, default=5)
+    args = parser.parse_args()
+
+    objs = find_objects(args.paths)
+    if len(objs) == 0:
+        print("No object file found")
+        sys.exit(1)
+
+    results = dict()
+    for backend in BACKENDS:
+        elapsed, results[backend] = bench(objs, backend, args.repeat)
+        print("{:<12} {:>6} objects in {:.3f}s: {:>10.0f} objects/s".format(backend, len(objs), elapsed, len(objs) / elapsed))
+
+    if results["mmap"] != results["pyelftools"]:
+        print("The backends do not return the same sections")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from capstone import Cs, CS_ARCH_X86, CS_MODE_64
+from aslr import binary_rewriter
+from rewriterBench import build_image, parse_mix
+
+class SliceInd:
+    # Reference: emission of the rewriter before the preallocated buffer (slice copy to remove a jump back)
+    def __init__(self, addr):
+        self.IndInst = dict()
+        self.addr = addr
+        self.bt = bytearray()
+
+    def addInsBytes(self, op, addr, offset=0x0):
+        barray = bytearray()
+        barray.append(op)
+        barray.extend((-(self.addr - addr) - offset).to_bytes(4, byteorder='little', signed=True))
+        self.IndInst[self.addr] = barray
+        self.addr += 5
+        self.bt.extend(barray)
+
+    def optimize_addrs(self):
+        self.addr -= 5
+        self.bt = self.bt[:-5]
+
+    def addIndBytes(self, next_addr, current_addr, ins_bytes, optimized_suit):
+        if optimized_suit > 0:
+            self.optimize_addrs()
+        op = ins_bytes[0]
+        if op == 0xe8:
+            self.addInsBytes(op, next_addr, 0x5)
+            self.addInsBytes(0xe9, current_addr)
+        elif op == 0xe9:
+            self.addInsBytes(op, next_addr, 0x5)
+            self.addInsBytes(0xe9, current_addr + 0x5)
+        else:
+            self.bt.extend(ins_bytes)
+            self.addr += 5
+            self.addInsBytes(0xe9, current_addr)
+
+    def addIndBytesBigger(self, ins_bytes, current_addr, optimized_suit):
+        if optimized_suit > 0:
+            self.optimize_addrs()
+        self.bt.extend(ins_bytes)
+        self.addr += len(ins_bytes)
+        self.addInsBytes(0xe9, current_addr)
+
+    def addIndBytesBiggerRip(self, ins, optimized_suit):
+        if optimized_suit > 0:
+            self.optimize_addrs()
+        addr = ins.address + binary_rewriter.rip_disp(ins)
+        previous_offset_bt = (addr - ins.address).to_bytes(4, byteorder='little', signed=True)
+        index_find = ins.bytes.find(previous_offset_bt)
+        barray = bytearray(ins.bytes[0:index_find])
+        barray.extend((addr - self.addr).to_bytes(4, byteorder='little', signed=True))
+        barray.extend(ins.bytes[index_find + len(previous_offset_bt):])
+        self.IndInst[self.addr] = barray
+        self.addr += len(ins.bytes)
+        self.bt.extend(barray)
+        self.addInsBytes(0xe9, ins.address)
+
+def reference_section(uk, s, ind_addr):
+    # Reference: the .text is rebuilt with one extend per instruction (same output as disassemble_section)
+    md = Cs(CS_ARCH_X86, CS_MODE_64)
+    md.detail = True
+    ind = SliceInd(ind_addr)
+    bt = bytearray()
+    optimized_suit = 0
+    for ins in md.disasm(s.content, s.virtual_address):
+        addrInt, _ = binary_rewriter.classify_operands(uk, ins, s)
+        size = len(ins.bytes)
+        if addrInt is None or size < 5:
+            bt.extend(ins.bytes)
+            optimized_suit = 0
+            continue
+
+        addr = ind.addr
+        if size == 5:
+            ind.addIndBytes(addrInt, ins.address, ins.bytes, optimized_suit)
+        elif binary_rewriter.rip_disp(ins) is not None:
+            ind.addIndBytesBiggerRip(ins, optimized_suit)
+        else:
+            ind.addIndBytesBigger(ins.bytes, ins.address, optimized_suit)
+        diff = addr - ins.address - (0xa if optimized_suit > 0 else 0x5)
+        barray = bytearray([0xe9])
+        barray.extend(diff.to_bytes(4, byteorder='little', signed=True))
+        for _ in range(size - 5):
+            barray.append(0x90)
+        bt.extend(barray)
+        optimized_suit += 1
+    return bt, ind.bt
+
+def load_uk(path):
+    uk = binary_rewriter.Unikernel(path)
+    binary_rewriter.process_file_mmap(uk)
+    uk.index = binary_rewriter.AddrIndex(uk.sections)
+    return uk
+
+def classify_only(uk, s):
+    # Disassembly and classification of the section (without any emission)
+    md = Cs(CS_ARCH_X86, CS_MODE_64)
+    md.detail = True
+    selected = list()
+    for ins in md.disasm(s.content, s.virtual_address):
+        addrInt, _ = binary_rewriter.classify_operands(uk, ins, s)
+        selected.append(addrInt is not None and len(ins.bytes) >= 5)
+    return selected
+
+def longest_run(selected):
+    best = run = 0
+    for v in selected:
+        run = run + 1 if v else 0
+        best = max(best, run)
+    return best
+
+def best_of(repeat, f, *args):
+    best = result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Cost of the trampoline emission of the binary rewriter on the microlibs of an image')
+    parser.add_argument('-f', '--file',    help='Relinked (not yet rewritten) aslr unikernel (*_local_align_aslr.dbg), a synthetic image otherwise', type=str)
+    parser.add_argument('-l', '--libs',    help='Microlibs to rewrite', nargs='+', default=["libnolibc", "liblwip"])
+    parser.add_argument('-r', '--repeat',  help='Number of runs (the best one is kept)', type=int, default=5)
+    parser.add_argument('--size',          help='Size of the .text of the synthetic microlib', type=lambda x: int(x, 0), default=0x100000)
+    parser.add_argument('--mix',           help='Weights of the instructions of the synthetic microlib (see rewriterBench.py)', nargs='*', default=[])
+    args = parser.parse_args()
+
+    # The image is mapped read/write: work on a copy
+    tmp = tempfile.mkdtemp(prefix="spacer-emit-")
+    try:
+        work = os.path.join(tmp, "image.dbg")
+        if args.file is not None:
+            shutil.copyfile(args.file, work)
+            libs = args.libs
+        else:
+            # A large microlib (which calls into a second one)
+            libs = build_image(work, 2, args.size, parse_mix(args.mix))[:1]
+        uk = load_uk(work)
+        for lib in libs:
+            s = uk.section_map.get(".text." + lib)
+            ind = uk.section_map.get(".ind." + lib)
+            if s is None or ind is None:
+                print("{}: no .text/.ind section".format(lib))
+                continue
+
+            total, (bt, ind_bt, counters) = best_of(args.repeat, binary_rewriter.disassemble_section, uk, s, ind.virtual_address)
+            reference, (ref_bt, ref_ind_bt) = best_of(args.repeat, reference_section, uk, s, ind.virtual_address)
+            classify, selected = best_of(args.repeat, classify_only, uk, s)
+            if ref_bt != bt or ref_ind_bt != ind_bt:
+                print("{}: the reference emission differs from the rewriter".format(lib))
+            emit = max(total - classify, 1e-9)
+            ref_emit = max(reference - classify, 1e-9)
+            print("{:<12} {:>8} instructions, {:>6} rewritten, {:>6} trampolines (longest run: {}), 0x{:x} bytes of .ind".format(
+                  lib, counters["instructions"], counters["rewritten"], counters["trampolines"], longest_run(selected), len(ind_bt)))
+            print("  total {:.4f}s - disassembly/classification {:.4f}s - emission {:.4f}s ({:.0f} trampolines/s)".format(
+                  total, classify, emit, counters["trampolines"] / emit))
+            print("  reference (slice copy) {:.4f}s - emission {:.4f}s - speedup of the emission x{:.2f}".format(
+                  reference, ref_emit, ref_emit / emit))
+        uk.mmap.close()
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
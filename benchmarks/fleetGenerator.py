@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import random
+import struct
+import argparse
+
+# Minimal ELF64 relocatable objects (x86_64): .text, .rodata, .data, .bss and .shstrtab
+EHDR       = struct.Struct("<16sHHIQQQIHHHHHH")
+SHDR       = struct.Struct("<IIQQQQIIQQ")
+ET_REL     = 1
+EM_X86_64  = 62
+SHT_PROGBITS, SHT_STRTAB, SHT_NOBITS = 1, 3, 8
+SHF_WRITE, SHF_ALLOC, SHF_EXECINSTR = 1, 2, 4
+
+COMMON_LIB = "libkvmqplat"
+
+# Same markers as the link64.lds of the kvm platforms
+LINK64_LDS = """OUTPUT_FORMAT("elf64-x86-64", "elf64-x86-64", "elf64-x86-64")
+OUTPUT_ARCH(i386:x86-64)
+ENTRY(_libkvmplat_entry)
+SECTIONS
+{
+ . = 0x100000;
+ _text = .;
+ .text :
+ {
+  KEEP (*(.data.boot))
+  *(.text.boot)
+  *(.text)
+  *(.text.*)
+ }
+ _etext = .;
+ . = ALIGN((1 << 12));
+ _ctors = .;
+ .preinit_array : {
+  KEEP (*(.preinit_array))
+ }
+ . = ALIGN(0x8);
+ .init_array : {
+  KEEP (*(.init_array .ctors))
+ }
+ _ectors = .;
+ . = ALIGN((1 << 12)); _rodata = .;
+ .rodata :
+ {
+  *(.rodata)
+  *(.rodata.*)
+ }
+ _erodata = .;
+ . = ALIGN((1 << 12));
+ _data = .;
+ .data :
+ {
+  *(.data)
+ }
+ _edata = .;
+ . = ALIGN((1 << 12));
+ __bss_start = .;
+ .bss :
+ {
+  *(.bss)
+  *(COMMON)
+ }
+ .intrstack :
+ {
+  *(.intrstack)
+ }
+ _end = .;
+}
+"""
+
+def elf_object(text, rodata, data, bss):
+    # (name, type, flags, addralign, content or size for NOBITS)
+    sections = [(".text", SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, 16, b"\x90" * (text - 1) + b"\xc3"),
+                (".rodata", SHT_PROGBITS, SHF_ALLOC, 32, bytes(rodata)),
+                (".data", SHT_PROGBITS, SHF_ALLOC | SHF_WRITE, 8, bytes(data)),
+                (".bss", SHT_NOBITS, SHF_ALLOC | SHF_WRITE, 32, bss)]
+
+    shstrtab = bytearray(b"\0")
+    names = list()
+    for name, *_ in sections + [(".shstrtab",)]:
+        names.append(len(shstrtab))
+        shstrtab.extend(name.encode() + b"\0")
+
+    body = bytearray(b"\0" * EHDR.size)
+    headers = [SHDR.pack(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)]
+    for (name, sh_type, flags, align, content), sh_name in zip(sections, names):
+        while len(body) % align:
+            body.append(0)
+        size = content if sh_type == SHT_NOBITS else len(content)
+        headers.append(SHDR.pack(sh_name, sh_type, flags, 0, len(body), size, 0, 0, align, 0))
+        if sh_type != SHT_NOBITS:
+            body.extend(content)
+    headers.append(SHDR.pack(names[-1], SHT_STRTAB, 0, 0, len(body), len(shstrtab), 0, 0, 1, 0))
+    body.extend(shstrtab)
+
+    while len(body) % 8:
+        body.append(0)
+    shoff = len(body)
+    ident = b"\x7fELF" + bytes([2, 1, 1, 0]) + bytes(8)
+    body[:EHDR.size] = EHDR.pack(ident, ET_REL, EM_X86_64, 1, 0, 0, shoff, 0, EHDR.size, 0, 0, SHDR.size, len(headers), len(headers) - 1)
+    return bytes(body) + b"".join(headers)
+
+def lib_object(name, variant=0):
+    # Sizes only depend on the name of the lib (and on its variant)
+    rng = random.Random("{}-{}".format(name, variant))
+    return elf_object(rng.randint(0x100, 0x10000), rng.randint(0x10, 0x4000), rng.randint(0x8, 0x800), rng.randint(0, 0x2000))
+
+def generate_fleet(workspace, n_uks, n_libs=64, per_uk=16, common=4, variants=0.0, seed=0):
+    # Each unikernel: the common libs, (per_uk - common) libs of the pool and its own app
+    rng = random.Random(seed)
+    apps = os.path.join(workspace, "apps")
+    if os.path.isdir(apps):
+        shutil.rmtree(apps)
+
+    commons = [COMMON_LIB] + ["libcommon{:03d}".format(i) for i in range(common - 1)]
+    pool = ["lib{:04d}".format(i) for i in range(n_libs)]
+    objects = dict()
+    uks = list()
+    for i in range(n_uks):
+        uk = "uk-{:05d}".format(i)
+        build = os.path.join(apps, uk, "build")
+        os.makedirs(os.path.join(build, COMMON_LIB))
+        with open(os.path.join(build, COMMON_LIB, "link64.lds"), "w") as f:
+            f.write(LINK64_LDS)
+
+        libs = commons + rng.sample(pool, min(len(pool), max(0, per_uk - common)))
+        for lib in libs:
+            # Some unikernels have a bigger version of a lib (as with other build options)
+            variant = 1 if rng.random() < variants else 0
+            if (lib, variant) not in objects:
+                objects[(lib, variant)] = lib_object(lib, variant)
+            with open(os.path.join(build, lib + ".o"), "wb") as f:
+                f.write(objects[(lib, variant)])
+        with open(os.path.join(build, "app{:05d}.o".format(i)), "wb") as f:
+            f.write(lib_object("app{:05d}".format(i)))
+        uks.append(uk)
+    return uks
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic fleet (apps/<uk>/build/ with ELF objects)')
+    parser.add_argument('-w', '--workspace', help='Workspace Directory (apps/ is replaced)', type=str, required=True)
+    parser.add_argument('-n', '--uks',       help='Number of unikernels', type=int, default=16)
+    parser.add_argument('--libs',            help='Number of libs in the pool', type=int, default=64)
+    parser.add_argument('--per_uk',          help='Number of libs of each unikernel (without its app)', type=int, default=16)
+    parser.add_argument('--common',          help='Number of libs used by all the unikernels', type=int, default=4)
+    parser.add_argument('--variants',        help='Probability that a unikernel has a bigger version of a lib', type=float, default=0.0)
+    parser.add_argument('--seed',            help='Seed of the generator', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.common < 1:
+        print("At least one common lib ({}) is required".format(COMMON_LIB))
+        sys.exit(1)
+
+    uks = generate_fleet(args.workspace, args.uks, args.libs, args.per_uk, args.common, args.variants, args.seed)
+    print("Generated {} unikernels in {}".format(len(uks), os.path.join(args.workspace, "apps")))
+
+if __name__ == '__main__':
+    main()
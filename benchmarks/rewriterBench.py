@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import time
+import random
+import shutil
+import struct
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import lief
+
+from capstone import Cs, CS_ARCH_X86, CS_MODE_64
+from capstone.x86 import X86_OP_REG, X86_OP_IMM, X86_OP_MEM, X86_REG_RIP
+from aslr import binary_rewriter
+
+EHDR      = struct.Struct("<16sHHIQQQIHHHHHH")
+PHDR      = struct.Struct("<IIQQQQQQ")
+SHDR      = struct.Struct("<IIQQQQIIQQ")
+PAGE_SIZE = 0x1000
+BASE_ADDR = 0x100000
+RODATA    = 0x4000
+
+# Largest trampoline: the instruction (7 bytes for a rip load) or a call/jmp (5), and the jump back (5)
+MAX_TRAMPOLINE = 17
+
+# Kind of instruction: weight by default
+MIX = {"call": 8, "jmp": 2, "rip": 6, "imm": 3, "local": 6, "other": 75}
+OTHERS = [b"\x90", b"\x48\x01\xd8", b"\x89\xc8", b"\x48\x89\xe5", b"\xbf\x10\x00\x00\x00", b"\xc3"]
+
+def round_page(v):
+    return (v + PAGE_SIZE - 1) & ~(PAGE_SIZE - 1)
+
+def rel32(target, addr, size):
+    return struct.pack("<i", target - (addr + size))
+
+def instruction_stream(rng, addr, size, other_texts, rodata, mix):
+    # Fill [addr, addr+size) with instructions of the mix (returns the bytes and the number of rewritable ones)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    bt = bytearray()
+    rewritable = 0
+    while True:
+        kind = rng.choices(kinds, weights)[0]
+        pc = addr + len(bt)
+        if kind in ["call", "jmp"]:
+            start, end = rng.choice(other_texts)
+            ins = (b"\xe8" if kind == "call" else b"\xe9") + rel32(rng.randrange(start, end), pc, 5)
+        elif kind == "rip":
+            ins = b"\x48\x8b\x05" + rel32(rodata + rng.randrange(RODATA), pc, 7)
+        elif kind == "imm":
+            ins = b"\xbf" + struct.pack("<I", rodata + rng.randrange(RODATA))
+        elif kind == "local":
+            ins = b"\xe8" + rel32(addr + rng.randrange(size), pc, 5)
+        else:
+            ins = rng.choice(OTHERS)
+        if len(bt) + len(ins) > size:
+            break
+        bt.extend(ins)
+        rewritable += kind not in ["local", "other"]
+    bt.extend(b"\x90" * (size - len(bt)))
+    return bytes(bt), rewritable
+
+def build_image(path, n_libs, text_size, mix, seed=0):
+    # ET_EXEC with a single RWX PT_LOAD: .text.<lib> and .ind.<lib> of each lib, then .rodata
+    rng = random.Random(seed)
+    names = ["lib{:03d}".format(i) for i in range(n_libs)]
+    texts = dict()
+    addr = BASE_ADDR + PAGE_SIZE
+    for name in names:
+        texts[name] = addr
+        # The .ind is placed after the .text (its size depends on the stream)
+        addr += round_page(text_size) + round_page(text_size * MAX_TRAMPOLINE)
+    rodata = addr
+
+    sections = list()
+    for name in names:
+        others = [(texts[o], texts[o] + text_size) for o in names if o != name] or [(rodata, rodata + RODATA)]
+        content, rewritable = instruction_stream(rng, texts[name], text_size, others, rodata, mix)
+        ind_size = max(PAGE_SIZE, round_page(rewritable * MAX_TRAMPOLINE))
+        sections.append((".text." + name, texts[name], content, 6))
+        sections.append((".ind." + name, texts[name] + round_page(text_size), bytes(ind_size), 6))
+    sections.append((".rodata", rodata, bytes(RODATA), 2))
+
+    image = bytearray(PAGE_SIZE)
+    shstrtab = bytearray(b"\0")
+    headers = [SHDR.pack(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)]
+    for name, vaddr, content, flags in sections:
+        offset = vaddr - BASE_ADDR
+        image.extend(bytes(offset - len(image)))
+        image.extend(content)
+        headers.append(SHDR.pack(len(shstrtab), 1, flags, vaddr, offset, len(content), 0, 0, PAGE_SIZE if name.startswith(".ind") else 16, 0))
+        shstrtab.extend(name.encode() + b"\0")
+    end = len(image)
+
+    name = len(shstrtab)
+    shstrtab.extend(b".shstrtab\0")
+    headers.append(SHDR.pack(name, 3, 0, 0, len(image), len(shstrtab), 0, 0, 1, 0))
+    image.extend(shstrtab)
+    image.extend(bytes(-len(image) % 8))
+
+    shoff = len(image)
+    ident = b"\x7fELF" + bytes([2, 1, 1, 0]) + bytes(8)
+    image[:EHDR.size] = EHDR.pack(ident, 2, 62, 1, texts[names[0]], EHDR.size, shoff, 0, EHDR.size, PHDR.size, 1, SHDR.size, len(headers), len(headers) - 1)
+    image[EHDR.size:EHDR.size + PHDR.size] = PHDR.pack(1, 7, PAGE_SIZE, BASE_ADDR + PAGE_SIZE, BASE_ADDR + PAGE_SIZE, end - PAGE_SIZE, end - PAGE_SIZE, PAGE_SIZE)
+    image.extend(b"".join(headers))
+
+    with open(path, "wb") as f:
+        f.write(image)
+    return names
+
+def read_sections(path):
+    binary = lief.parse(path)
+    return {s.name: (s.virtual_address, bytes(s.content)) for s in binary.sections}
+
+def effect(ins):
+    # What an instruction does, whatever its address
+    ops = list()
+    for op in ins.operands:
+        if op.type == X86_OP_REG:
+            ops.append(("reg", op.reg))
+        elif op.type == X86_OP_IMM:
+            ops.append(("imm", op.imm))
+        elif op.type == X86_OP_MEM and op.mem.base == X86_REG_RIP:
+            ops.append(("mem", ins.address + ins.size + op.mem.disp, op.size))
+        elif op.type == X86_OP_MEM:
+            ops.append(("mem", op.mem.base, op.mem.index, op.mem.scale, op.mem.disp, op.size))
+    return ins.mnemonic, tuple(ops)
+
+def verify(orig, new, names):
+    # Every rewritten instruction must jump to a trampoline doing the same and jumping back after it
+    md = Cs(CS_ARCH_X86, CS_MODE_64)
+    md.detail = True
+    errors = list()
+    checked = 0
+    for name in names:
+        va, text = orig[".text." + name]
+        _, new_text = new[".text." + name]
+        ind_va, ind = new[".ind." + name]
+        original = {ins.address: ins for ins in md.disasm(text, va)}
+        end = va + len(text)
+
+        for addr, ins in original.items():
+            o = addr - va
+            if new_text[o:o + ins.size] == text[o:o + ins.size]:
+                continue
+            checked += 1
+            if new_text[o] != 0xe9 or new_text[o + 5:o + ins.size] != b"\x90" * (ins.size - 5):
+                errors.append("{}: 0x{:x} is not a jmp to a trampoline".format(name, addr))
+                continue
+            pc = addr + 5 + struct.unpack_from("<i", new_text, o + 1)[0]
+            cursor = last = addr
+            while True:
+                if not ind_va <= pc < ind_va + len(ind):
+                    errors.append("{}: 0x{:x} jumps outside of .ind (0x{:x})".format(name, addr, pc))
+                    break
+                tramp = next(md.disasm(ind[pc - ind_va:pc - ind_va + 16], pc), None)
+                if tramp is None:
+                    errors.append("{}: invalid instruction at 0x{:x} (.ind)".format(name, pc))
+                    break
+                if tramp.bytes[0] == 0xe9 and va <= tramp.operands[0].imm <= end:
+                    # Jump back: after the last instruction done by the trampoline (or in its nop padding)
+                    back = tramp.operands[0].imm
+                    if cursor == addr or not last + 5 <= back <= cursor or new_text[back - va:cursor - va] != b"\x90" * (cursor - back):
+                        errors.append("{}: 0x{:x} jumps back to 0x{:x} instead of 0x{:x}".format(name, addr, back, cursor))
+                    break
+                if cursor not in original or effect(tramp) != effect(original[cursor]):
+                    errors.append("{}: 0x{:x} ({} {}) is not 0x{:x} ({} {})".format(name, pc, tramp.mnemonic, tramp.op_str, cursor,
+                                  original[cursor].mnemonic if cursor in original else "?", original[cursor].op_str if cursor in original else ""))
+                    break
+                if tramp.mnemonic == "jmp":
+                    # The jump back after an unconditional jmp is never reached
+                    break
+                last = cursor
+                cursor += original[cursor].size
+                pc += tramp.size
+    return checked, errors
+
+def bytes_rewritten(orig, new, names):
+    total = 0
+    for name in names:
+        _, text = orig[".text." + name]
+        _, new_text = new[".text." + name]
+        _, ind = new[".ind." + name]
+        total += sum(1 for a, b in zip(text, new_text) if a != b) + len(ind.rstrip(b"\0"))
+    return total
+
+def parse_mix(values):
+    mix = dict(MIX)
+    for v in values:
+        k, w = v.split("=")
+        if k not in MIX:
+            raise argparse.ArgumentTypeError("unknown kind {} ({})".format(k, ", ".join(MIX)))
+        mix[k] = float(w)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and correctness of the binary rewriter on synthetic images')
+    parser.add_argument('--libs',        help='Number of .text.<lib> sections', type=int, default=16)
+    parser.add_argument('--size',        help='Size of each .text.<lib>', type=lambda x: int(x, 0), default=0x10000)
+    parser.add_argument('--mix',         help='Weights of the instructions ({})'.format(" ".join("{}={}".format(k, v) for k, v in MIX.items())), nargs='*', default=[])
+    parser.add_argument('-r', '--repeat', help='Number of runs (the best one is kept)', type=int, default=3)
+    parser.add_argument('--jobs',        help="Number of sections rewritten in parallel", type=int, default=1)
+    parser.add_argument('--classifier',  help="Classifier of the instructions to rewrite", choices=binary_rewriter.CLASSIFIERS, default=binary_rewriter.CLASSIFIERS[0])
+    parser.add_argument('--seed',        help='Seed of the instruction streams', type=int, default=0)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="spacer-rewriter-")
+    try:
+        image = os.path.join(tmp, "image.dbg")
+        work = os.path.join(tmp, "image_aslr.dbg")
+        names = build_image(image, args.libs, args.size, parse_mix(args.mix), args.seed)
+
+        best = counters = None
+        for _ in range(args.repeat):
+            shutil.copyfile(image, work)
+            start = time.perf_counter()
+            counters = binary_rewriter.rewrite_uk(work, os.path.join(tmp, "ind_map.json"), False, args.jobs, args.classifier)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        orig = read_sections(image)
+        new = read_sections(work)
+        checked, errors = verify(orig, new, names)
+    finally:
+        shutil.rmtree(tmp)
+
+    print("{} libs of 0x{:x} bytes: {} instructions, {} rewritten, {} trampolines in {:.3f}s".format(args.libs, args.size, counters["instructions"], counters["rewritten"], counters["trampolines"], best))
+    print("  {:>12.0f} instructions/s".format(counters["instructions"] / best))
+    print("  {:>12.0f} trampolines/s".format(counters["trampolines"] / best))
+    print("  {:>12} bytes rewritten".format(bytes_rewritten(orig, new, names)))
+    print("Verified {} rewritten instructions: {} errors".format(checked, len(errors)))
+    for e in errors[:20]:
+        print("  " + e)
+    if len(errors) > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
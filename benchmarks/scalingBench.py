@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import json
+import math
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from fleetGenerator import generate_fleet
+from ukManager import UkManager
+from metrics import Metrics
+from utils import logger
+
+STAGES = ["scan", "classify", "layout", "scripts"]
+
+def manager(workspace, uks, jobs):
+    # Same options as the aligner (no relink, no copy, no aslr)
+    args = argparse.Namespace(workspace=workspace, rel=False, loc=0x130000, uks=uks, align=True, copy_objs=False, aslr=0, aslr_inplace=False, aslr_trace=False,
+                              jobs=jobs, pack=False, state=None, reserve=0, cache=None, cache_size=0, cache_hash=False,
+                              store=None, store_hardlink=False)
+    return UkManager(args)
+
+def run(workspace, uks, jobs):
+    m = Metrics()
+    ukManager = manager(workspace, uks, jobs)
+    with m.phase("scan"):
+        ukManager.process_folder()
+    with m.phase("classify"):
+        ukManager.process_maps()
+    with m.phase("layout"):
+        ukManager.compute_layout_spacer(True)
+    with m.phase("scripts"):
+        size = sum(len(ukManager.process_link64_spacer(uk)) for uk in ukManager.uks)
+    return {k: m.phases[k]["wall_seconds"] for k in STAGES}, size
+
+def main():
+    parser = argparse.ArgumentParser(description='Time of the scan and layout stages on synthetic fleets')
+    parser.add_argument('-w', '--workspace', help='Workspace Directory (default: a temporary directory)', type=str, default=None)
+    parser.add_argument('-n', '--uks',       help='Numbers of unikernels', type=int, nargs='+', default=[2, 8, 32, 128, 512, 2048])
+    parser.add_argument('--libs',            help='Number of libs in the pool', type=int, default=256)
+    parser.add_argument('--per_uk',          help='Number of libs of each unikernel (without its app)', type=int, default=24)
+    parser.add_argument('--common',          help='Number of libs used by all the unikernels', type=int, default=6)
+    parser.add_argument('--variants',        help='Probability that a unikernel has a bigger version of a lib', type=float, default=0.05)
+    parser.add_argument('-j', '--jobs',      help='Number of parallel jobs of the scan', type=int, default=1)
+    parser.add_argument('--json',            help='Write the results to this json file', type=str, default=None)
+    args = parser.parse_args()
+
+    logger.setLevel(logging.CRITICAL)
+    workspace = args.workspace or tempfile.mkdtemp(prefix="spacer-fleet-")
+    workspace = os.path.join(workspace, "")
+
+    results = list()
+    print("{:>6} {}  {:>10}  {}".format("uks", " ".join("{:>9}".format(s) for s in STAGES), "us/uk", "growth (per stage)"))
+    try:
+        for n in args.uks:
+            uks = generate_fleet(workspace, n, args.libs, args.per_uk, args.common, args.variants)
+            times, size = run(workspace, uks, args.jobs)
+            results.append({"uks": n, "times": times, "script_bytes": size})
+
+            # Exponent of the growth since the previous size (1: linear, 2: quadratic)
+            growth = ""
+            if len(results) > 1:
+                prev = results[-2]
+                growth = " ".join("{:>5.2f}".format(math.log(max(times[k], 1e-9) / max(prev["times"][k], 1e-9)) / math.log(n / prev["uks"])) for k in STAGES)
+            print("{:>6} {}  {:>10.1f}  {}".format(n, " ".join("{:>8.3f}s".format(times[k]) for k in STAGES), sum(times.values()) / n * 1e6, growth))
+    finally:
+        if args.workspace is None:
+            shutil.rmtree(workspace)
+
+    if args.json is not None:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=4)
+
+if __name__ == '__main__':
+    main()
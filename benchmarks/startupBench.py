@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+
+# Import of the aligner in a new interpreter, and the modules it pulled in
+IMPORT_CODE = "import sys, time; s = time.perf_counter(); import aligner; print(time.perf_counter() - s, *[m in sys.modules for m in ('lief', 'capstone', 'elftools')])"
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of the aligner (spacer path)')
+    parser.add_argument('-r', '--repeat', help='Number of runs (the best one is kept)', type=int, default=10)
+    args = parser.parse_args()
+
+    best_import = best_run = None
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, "-c", IMPORT_CODE], cwd=ROOT, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout.split()
+        elapsed = float(out[0])
+        best_import = elapsed if best_import is None else min(best_import, elapsed)
+
+        # Whole process: interpreter, imports and argument parsing
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, "aligner.py"), "-h"], stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        best_run = elapsed if best_run is None else min(best_run, elapsed)
+
+    print("import aligner: {:.3f}s".format(best_import))
+    print("aligner.py -h:  {:.3f}s".format(best_run))
+    print("lief: {} capstone: {} pyelftools: {}".format(*["imported" if m == "True" else "not imported" for m in out[1:]]))
+
+if __name__ == '__main__':
+    main()
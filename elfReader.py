@@ -0,0 +1,80 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import mmap
+import struct
+
+# ELF64 little endian: header and section header (only what the scan needs)
+ELF_MAGIC   = b"\x7fELF"
+ELFCLASS64  = 2
+ELFDATA2LSB = 1
+EHDR        = struct.Struct("<16sHHIQQQIHHHHHH")
+SHDR        = struct.Struct("<IIQQQQIIQQ")
+SHN_XINDEX  = 0xffff
+E_TYPES     = {0: "ET_NONE", 1: "ET_REL", 2: "ET_EXEC", 3: "ET_DYN", 4: "ET_CORE"}
+
+def read_section_headers(path, s_name):
+    # Same result as unikernels.read_sections: (e_type, [(name, size, addr, offset, addralign) or None])
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        if len(m) < EHDR.size:
+            raise ValueError("{}: too small for an ELF header".format(path))
+        ident, e_type, _, _, _, _, e_shoff, _, _, _, _, e_shentsize, e_shnum, e_shstrndx = EHDR.unpack_from(m, 0)
+        if ident[:4] != ELF_MAGIC or ident[4] != ELFCLASS64 or ident[5] != ELFDATA2LSB:
+            raise ValueError("{}: not an ELF64 little endian file".format(path))
+
+        sections = [None] * len(s_name)
+        if e_shoff == 0:
+            return E_TYPES.get(e_type, e_type), sections
+        if e_shentsize != SHDR.size:
+            raise ValueError("{}: unexpected section header size {}".format(path, e_shentsize))
+
+        # More than 0xff00 sections: the real values are in the first section header
+        if e_shnum == 0 or e_shstrndx == SHN_XINDEX:
+            sh0 = SHDR.unpack_from(m, e_shoff)
+            if e_shnum == 0:
+                e_shnum = sh0[5]
+            if e_shstrndx == SHN_XINDEX:
+                e_shstrndx = sh0[6]
+        if e_shoff + e_shnum * SHDR.size > len(m) or e_shstrndx >= e_shnum:
+            raise ValueError("{}: truncated section header table".format(path))
+
+        strtab_offset = SHDR.unpack_from(m, e_shoff + e_shstrndx * SHDR.size)[4]
+        wanted = {s: i for i, s in enumerate(s_name)}
+        for n in range(e_shnum):
+            sh_name, _, _, sh_addr, sh_offset, sh_size, _, _, sh_addralign, _ = SHDR.unpack_from(m, e_shoff + n * SHDR.size)
+            start = strtab_offset + sh_name
+            end = m.find(b"\0", start)
+            name = m[start:end if end >= 0 else len(m)].decode("utf-8", "replace")
+            # The last section with a given name is kept (as pyelftools)
+            if name in wanted:
+                sections[wanted[name]] = (name, sh_size, sh_addr, sh_offset, sh_addralign)
+
+    return E_TYPES.get(e_type, e_type), sections
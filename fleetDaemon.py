@@ -0,0 +1,343 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import copy
+import json
+import stat
+import time
+import socket
+import argparse
+import threading
+import socketserver
+
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from ukManager import UkManager
+from fleetState import FleetState
+from unikernels import Unikernel, read_sections, SEC_NAME, OBJ_EXT
+from utils import logger
+from metrics import metrics
+
+# Counters reported by the requests (difference before/after)
+REPORTED = ["objects_parsed", "relinked_unikernels", "relink_failures", "rewritten_unikernels", "rewrite_failures"]
+
+class FleetService:
+    def __init__(self, args, align_fleet):
+        self.args = args
+        self.align_fleet = align_fleet
+        self.workspace = os.path.join(args.workspace + "apps")
+        self.names = list()
+        # Sections of the object files of each unikernel ({path: (mtime_ns, size, info)}), as read by the scan
+        self.objects = dict()
+        # Unikernels with objects changed since their last alignment
+        self.dirty = set()
+        self.lock = threading.RLock()
+        self.ops = {"add": self.add, "remove": self.remove, "realign": self.realign, "relink": self.relink, "status": self.status}
+
+    def build_path(self, name):
+        return os.path.join(self.workspace, name, "build/")
+
+    def refresh(self, names, mark=True):
+
+        # Stat the objects of the unikernels and only read the new or modified ones
+        changed = list()
+        for name in names:
+            path = self.build_path(name)
+            entries = self.objects.setdefault(name, dict())
+            listed = set()
+            for lib in Unikernel(name, os.path.join(self.workspace, name)).list_objects(path):
+                st = os.stat(path + lib)
+                listed.add(path + lib)
+                entry = entries.get(path + lib)
+                if entry is None or entry[0] != st.st_mtime_ns or entry[1] != st.st_size:
+                    changed.append((name, path + lib, st))
+
+            removed = [p for p in entries if p not in listed]
+            for p in removed:
+                del entries[p]
+            if mark and len(removed) > 0:
+                self.dirty.add(name)
+
+        paths = [p for _, p, _ in changed]
+        if self.args.jobs > 1 and len(paths) > 1:
+            chunksize = max(1, len(paths) // (self.args.jobs * 4))
+            with ProcessPoolExecutor(max_workers=self.args.jobs) as executor:
+                infos = list(executor.map(read_sections, paths, repeat(SEC_NAME), chunksize=chunksize))
+        else:
+            infos = [read_sections(p, SEC_NAME) for p in paths]
+        metrics.inc("objects_parsed", len(paths))
+        metrics.inc("object_bytes_parsed", sum(st.st_size for _, _, st in changed))
+
+        for (name, p, st), info in zip(changed, infos):
+            self.objects[name][p] = (st.st_mtime_ns, st.st_size, info)
+            if mark:
+                self.dirty.add(name)
+        return len(changed)
+
+    def sections_info(self):
+        return {p: info for entries in self.objects.values() for p, (_, _, info) in entries.items()}
+
+    def copied(self, name, dst, info):
+        # An object copied by the aligner has the sections of its source (it is not read again)
+        if info is not None and os.path.isfile(dst):
+            st = os.stat(dst)
+            self.objects[name][dst] = (st.st_mtime_ns, st.st_size, info)
+
+    def manager(self, names, relink=None):
+        args = copy.copy(self.args)
+        args.uks = names
+        if relink is not None:
+            args.rel = relink
+        return UkManager(args)
+
+    def add(self, name, realign=False):
+
+        if not os.path.isdir(self.build_path(name)):
+            raise ValueError("{} has no build folder".format(name))
+        self.refresh([name])
+        if name not in self.names:
+            self.names.append(name)
+
+        if realign:
+            return self.realign()
+
+        # Incremental: place the new unikernel in the layout of the fleet (see --state), without relinking the others
+        if self.args.state is not None and os.path.isfile(self.args.state) and self.args.aslr == 0:
+            ukManager = self.manager([name])
+            sections_info = self.sections_info()
+            ukManager.add_unikernel(name, sections_info)
+            for p in list(self.objects[name]):
+                self.copied(name, p, sections_info.get(p))
+            self.dirty.discard(name)
+            return {"mode": "incremental", "unikernels": len(self.names)}
+
+        # Placed by the next realign
+        self.dirty.add(name)
+        return {"mode": "pending", "unikernels": len(self.names)}
+
+    def remove(self, name):
+
+        if name not in self.names:
+            raise ValueError("{} is not part of the fleet".format(name))
+        self.names.remove(name)
+        self.objects.pop(name, None)
+        self.dirty.discard(name)
+
+        # Its libs keep their addresses (the space is reclaimed by the next realign)
+        if self.args.state is not None and os.path.isfile(self.args.state):
+            state = FleetState.load(self.args.state)
+            state.unikernels.pop(name, None)
+            for lib in state.libs.values():
+                if name in lib["users"]:
+                    lib["users"].remove(name)
+            state.save(self.args.state)
+        return {"unikernels": len(self.names)}
+
+    def realign(self, relink=None):
+
+        # Full alignment of the fleet from the sections in memory (only the modified objects are read)
+        self.refresh(self.names)
+        sections_info = self.sections_info()
+        ukManager = self.manager(self.names, relink)
+        ukManager.process_folder(sections_info)
+        self.align_fleet(ukManager, self.args)
+
+        if ukManager.copy_objs:
+            for uk in ukManager.uks:
+                for obj in uk.objects:
+                    if obj in ukManager.objs_files:
+                        self.copied(uk.name, self.build_path(uk.name) + obj + OBJ_EXT, sections_info.get(ukManager.objs_files[obj][0]))
+        self.refresh(self.names, mark=False)
+        self.dirty = set()
+        return {"unikernels": len(ukManager.uks), "libs": len(ukManager.global_maps)}
+
+    def relink(self, names=None):
+
+        # Relink with the current link files (e.g. after a rebuild of some objects)
+        if names is None:
+            names = list(self.names)
+        for name in names:
+            if name not in self.names:
+                raise ValueError("{} is not part of the fleet".format(name))
+
+        sections_info = self.sections_info()
+        ukManager = self.manager(names)
+        for name in names:
+            uk = Unikernel(name, os.path.join(self.workspace, name))
+            uk.process_build_folder(self.build_path(name), dict(), dict(), update=False, sections_info=sections_info)
+            ukManager.uks.append(uk)
+            ukManager.relink(name, os.path.join(uk.workspace, "build"), uk.use_vfscore, uk.kvm_plat)
+        failed = ukManager.relink_all()
+        if self.args.aslr > 0:
+            ukManager.uks = [uk for uk in ukManager.uks if uk.name not in failed]
+            ukManager.binary_rewrite()
+        return {"relinked": [name for name in names if name not in failed], "failed": failed}
+
+    def status(self):
+        requests = dict()
+        for op in self.ops:
+            p = metrics.phases.get("request_" + op)
+            if p is not None:
+                requests[op] = {"count": p["calls"], "mean_seconds": p["wall_seconds"] / p["calls"]}
+        return {"unikernels": self.names, "dirty": sorted(self.dirty), "objects": sum(len(entries) for entries in self.objects.values()), "requests": requests}
+
+    def handle(self, request):
+
+        op = request.get("op")
+        if op not in self.ops:
+            return {"ok": False, "op": op, "error": "unknown op (expected: {})".format(", ".join(self.ops))}
+
+        params = {k: v for k, v in request.items() if k != "op"}
+        before = dict(metrics.counters)
+        start = time.perf_counter()
+        try:
+            with self.lock, metrics.phase("request_" + op):
+                response = {"ok": True}
+                response.update(self.ops[op](**params))
+        except (ValueError, TypeError, OSError) as e:
+            response = {"ok": False, "error": str(e)}
+        except SystemExit:
+            # Fatal error of the aligner (already logged): the daemon keeps running
+            response = {"ok": False, "error": "aborted (see the log of the daemon)"}
+        except Exception as e:
+            # Unexpected error: logged with its traceback, the client still gets a response
+            logger.exception("Request {} failed".format(json.dumps(request)))
+            response = {"ok": False, "error": "internal error - {}".format(e)}
+        response["op"] = op
+        response["latency"] = time.perf_counter() - start
+        for k in REPORTED:
+            if metrics.counters[k] != before.get(k, 0):
+                response[k] = metrics.counters[k] - before.get(k, 0)
+
+        logger.info("Request {} (time: {:.3f}) {}".format(json.dumps(request), response["latency"], "ok" if response["ok"] else response["error"]))
+        return response
+
+    def watch(self, interval, stop):
+        # Poll the build folders: modified objects are read again and their unikernels are marked
+        while not stop.wait(interval):
+            try:
+                with self.lock:
+                    changed = self.refresh(self.names)
+            except (ValueError, OSError) as e:
+                # e.g. a build in progress: retried at the next poll
+                logger.warning("Cannot scan the build folders - {}".format(e))
+                continue
+            except Exception:
+                # The watcher must not die: retried at the next poll
+                logger.exception("Cannot scan the build folders")
+                continue
+            if changed > 0:
+                logger.info("{} objects changed (to realign: {})".format(changed, ", ".join(sorted(self.dirty))))
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    # One JSON request per line, one JSON response per line
+    def handle(self):
+        for line in self.rfile:
+            if len(line.strip()) == 0:
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("a request is a JSON object")
+                response = self.server.service.handle(request)
+            except ValueError as e:
+                response = {"ok": False, "error": "invalid request - {}".format(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+
+def serve(args, align_fleet):
+
+    service = FleetService(args, align_fleet)
+    service.names = sorted(d for d in os.listdir(service.workspace) if d in args.uks)
+    start = time.perf_counter()
+    service.refresh(service.names, mark=False)
+    logger.info("Scanned {} objects of {} unikernels (time: {:.3f})".format(len(service.sections_info()), len(service.names), time.perf_counter() - start))
+
+    # A socket left by a previous daemon is replaced
+    if os.path.exists(args.daemon) and stat.S_ISSOCK(os.stat(args.daemon).st_mode):
+        os.unlink(args.daemon)
+
+    stop = threading.Event()
+    if args.watch > 0:
+        threading.Thread(target=service.watch, args=(args.watch, stop), daemon=True).start()
+
+    server = socketserver.ThreadingUnixStreamServer(args.daemon, RequestHandler)
+    server.service = service
+    logger.info("Listening on {}".format(args.daemon))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        os.unlink(args.daemon)
+
+def request(path, req):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall((json.dumps(req) + "\n").encode())
+        return json.loads(s.makefile("r").readline())
+
+def main():
+    parser = argparse.ArgumentParser(description='Client of the aligner daemon (aligner.py --daemon)')
+    parser.add_argument('socket',          help='Unix socket of the daemon', type=str)
+    parser.add_argument('op',              help='Request', choices=["add", "remove", "realign", "relink", "status"])
+    parser.add_argument('names',           help='Unikernels (add, remove, relink)', nargs='*')
+    parser.add_argument('--no_relink',     help="Realign without relinking", action='store_true')
+    args = parser.parse_args()
+
+    if args.op in ["add", "remove"]:
+        if len(args.names) == 0:
+            parser.error("{} requires at least one unikernel".format(args.op))
+        requests = [{"op": args.op, "name": name} for name in args.names]
+    elif args.op == "relink":
+        requests = [{"op": "relink", "names": args.names or None}]
+    elif args.op == "realign":
+        requests = [{"op": "realign", "relink": False if args.no_relink else None}]
+    else:
+        requests = [{"op": "status"}]
+
+    ok = True
+    for req in requests:
+        try:
+            response = request(args.socket, req)
+        except OSError as e:
+            print("Cannot reach the daemon on {} - {}".format(args.socket, e))
+            sys.exit(1)
+        print(json.dumps(response))
+        ok = ok and response["ok"]
+    if not ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
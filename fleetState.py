@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import json
+
+from collections import Counter
+from utils import round_to_n, logger
+
+STATE_VERSION = 2
+PAGE_SIZE     = 0x1000
+LAYOUT_SECT   = [".text", ".rodata"]
+
+class FleetState:
+    def __init__(self):
+        self.loc_sect = dict()
+        self.common = {k: dict() for k in LAYOUT_SECT}
+        self.libs = dict()
+        self.unikernels = dict()
+        self.gaps = dict()
+        self.reserve = 0
+        # Space at each address of a lib: [[addr, size], ...] by section and lib
+        self.slots = {k: dict() for k in LAYOUT_SECT}
+
+    @classmethod
+    def load(cls, path):
+        state = cls()
+        with open(path, "r") as json_file:
+            data = json.load(json_file)
+        if data.get("version") != STATE_VERSION:
+            raise ValueError("unsupported state version {}".format(data.get("version")))
+        state.loc_sect = data["loc_sect"]
+        state.common = data["common"]
+        state.libs = data["libs"]
+        state.unikernels = data["unikernels"]
+        state.gaps = data["gaps"]
+        state.reserve = data.get("reserve", 0)
+        state.slots = data["slots"]
+        return state
+
+    def save(self, path):
+        # Class of each lib: common (to all), subset or individual (one unikernel)
+        for name, lib in self.libs.items():
+            if any(name in self.common[k] for k in LAYOUT_SECT):
+                lib["class"] = "common"
+            elif len(lib["users"]) > 1:
+                lib["class"] = "subset"
+            else:
+                lib["class"] = "individual"
+
+        tmp = path + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump({"version": STATE_VERSION, "loc_sect": self.loc_sect, "common": self.common, "libs": self.libs, "unikernels": self.unikernels, "gaps": self.gaps, "reserve": self.reserve, "slots": self.slots}, fp, indent=4)
+        os.replace(tmp, path)
+        logger.info("Written fleet state {}".format(path))
+
+    def overlaps(self, placed, addr, size):
+        for start, end in placed:
+            if addr < end and start < addr + size:
+                return True
+        return False
+
+    def slot(self, lib, type_sect, addr):
+        # Bytes available for the lib at this address (0: unknown address)
+        for start, size in self.slots[type_sect].get(lib, list()):
+            if start == addr:
+                return size
+        return 0
+
+    def add_slot(self, lib, type_sect, addr, size):
+        if self.slot(lib, type_sect, addr) == 0:
+            self.slots[type_sect].setdefault(lib, list()).append([addr, size])
+
+    def place(self, lib, type_sect, size, addralign, placed):
+
+        # Reuse the address of the lib in another unikernel (if the lib fits in its slot and it does not overlap)
+        if lib in self.libs:
+            addrs = Counter(uk[type_sect][lib] for uk in self.unikernels.values() if lib in uk[type_sect])
+            for addr, _ in addrs.most_common():
+                if size <= self.slot(lib, type_sect, addr) and not self.overlaps(placed, addr, size):
+                    placed.append((addr, addr + size))
+                    return addr
+
+        # New lib: use the gap reserved by the full alignment
+        if type_sect not in self.gaps:
+            return None
+        cursor, end = self.gaps[type_sect]
+        addr = round_to_n(cursor, PAGE_SIZE if ".text" in type_sect else max(1, addralign))
+        if addr + size > end or self.overlaps(placed, addr, size):
+            return None
+
+        self.gaps[type_sect][0] = addr + size
+        placed.append((addr, addr + size))
+        self.add_slot(lib, type_sect, addr, size)
+        return addr
@@ -0,0 +1,126 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import json
+
+from bisect import bisect_left
+from utils import logger
+
+# Bytes of a trampoline (see aslr/binary_rewriter.py): a 5 bytes instruction is copied
+# (or becomes a call/jmp) and followed by a jump back; a longer one is copied with a jump back
+TRAMPOLINE_SMALL = 10
+JUMP_BACK        = 5
+
+# Constants from this address could be addresses of the linked unikernel
+ADDR_MIN = 0x100000
+
+# R_X86_64_64, R_X86_64_32 and R_X86_64_32S: absolute addresses, whatever the target section
+ABSOLUTE_RELOCS = [1, 10, 11]
+
+# Bumped when the prediction changes (older predictions are discarded)
+PREDICTOR_VERSION = 2
+
+def predict_ind_size(path):
+    # Upper bound of the .ind bytes of the .text of an object (pyelftools and capstone: aslr only)
+    from elftools.elf.elffile import ELFFile
+    from elftools.elf.relocation import RelocationSection
+    from capstone import Cs, CS_ARCH_X86, CS_MODE_64, CS_GRP_JUMP, CS_GRP_CALL
+    from capstone.x86 import X86_OP_IMM, X86_OP_MEM, X86_REG_RIP
+
+    with open(path, "rb") as f:
+        elf = ELFFile(f)
+        text_index = elf.get_section_index(".text")
+        if text_index is None:
+            return 0, 0
+        text = elf.get_section(text_index).data()
+
+        # Absolute addresses and relative references to other sections (outside of .text.<lib> once linked)
+        relocated = list()
+        for sec in elf.iter_sections():
+            if not isinstance(sec, RelocationSection) or sec["sh_info"] != text_index:
+                continue
+            symtab = elf.get_section(sec["sh_link"])
+            for rel in sec.iter_relocations():
+                if rel["r_info_type"] in ABSOLUTE_RELOCS or symtab.get_symbol(rel["r_info_sym"])["st_shndx"] != text_index:
+                    relocated.append(rel["r_offset"])
+    relocated.sort()
+
+    md = Cs(CS_ARCH_X86, CS_MODE_64)
+    md.detail = True
+    size = 0
+    count = 0
+    for ins in md.disasm(text, 0):
+        if ins.size < 5:
+            continue
+
+        i = bisect_left(relocated, ins.address)
+        rewritten = i < len(relocated) and relocated[i] < ins.address + ins.size
+        if not rewritten:
+            # Constant which may be used as an absolute address
+            for op in ins.operands:
+                if op.type == X86_OP_IMM and not (ins.group(CS_GRP_JUMP) or ins.group(CS_GRP_CALL)):
+                    value = op.imm & 0xffffffffffffffff
+                elif op.type == X86_OP_MEM and op.mem.base != X86_REG_RIP:
+                    value = op.mem.disp & 0xffffffffffffffff
+                else:
+                    continue
+                if ADDR_MIN <= value < 1 << 32:
+                    rewritten = True
+                    break
+
+        if rewritten:
+            count += 1
+            size += TRAMPOLINE_SMALL if ins.size == 5 else ins.size + JUMP_BACK
+    return size, count
+
+def predict_worker(path):
+    try:
+        return predict_ind_size(path), None
+    except Exception as e:
+        return None, "{}: {}".format(path, e)
+
+def load_predictions(json_file):
+    if os.path.isfile(json_file):
+        with open(json_file, "r") as fp:
+            predictions = json.load(fp)
+        if predictions.get("version") == PREDICTOR_VERSION:
+            return predictions
+        logger.info("Discard the .ind predictions of {} (older version)".format(json_file))
+    return dict()
+
+def save_predictions(json_file, predictions):
+    predictions["version"] = PREDICTOR_VERSION
+    tmp = json_file + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump(predictions, fp, indent=4, sort_keys=True)
+    os.replace(tmp, json_file)
+    logger.info("Written {} .ind predictions in {}".format(len(predictions) - 1, json_file))
@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from stringBuilder import StringBuilder
+
+# Insertion points of link64.lds (a marker " . = <addr>;" is written for the loc_sect ones)
+TEXT_SLOT   = ".text.*"
+RODATA_SLOT = ".rodata.*"
+LOC_MARKERS = {"_etext": "_etext", "_ctors": "_ctors", "_ectors": "_ectors", ".init_array": ".init_array",
+               "_data": ".data", "__bss_start": ".bss", ".intrstack": ".intrstack"}
+MARKER_LINES = {" .init_array : {": ".init_array", " _data = .;": "_data", " __bss_start = .;": "__bss_start", " .intrstack :": ".intrstack"}
+
+class LinkTemplate:
+    def __init__(self, path, aslr):
+        self.path = path
+        self.aslr = aslr
+        self.parts = list()
+
+    @classmethod
+    def load(cls, path, aslr=False):
+        template = cls(path, aslr)
+        with open(path, "r") as file_in:
+            template.parse(file_in.read().splitlines())
+        return template
+
+    def slot(self, name):
+        self.parts.append((name,))
+
+    def literal(self, s):
+        if len(self.parts) > 0 and isinstance(self.parts[-1], str):
+            self.parts[-1] += s
+        else:
+            self.parts.append(s)
+
+    def parse(self, lines):
+        # Same rules as the line by line rewriting: the fragments are only filled in by render
+        done = False
+        closed = 0
+        for l in lines:
+            if "*(.text)" in l or "*(.rodata)" in l:
+                self.literal(" }\n")
+                closed += 1
+                continue
+            elif not self.aslr and "_etext = .;" in l:
+                self.literal(l + "\n")
+                self.slot("_etext")
+                continue
+            elif "*(.text.*)" in l:
+                self.slot(TEXT_SLOT)
+                done = True
+                continue
+            elif done and "}" in l:
+                done = False
+                continue
+            elif not self.aslr and ("_ctors = .;" in l or "_ectors = .;" in l):
+                self.slot(l.split("=")[0].strip())
+            elif "*(.rodata.*)" in l:
+                self.slot(RODATA_SLOT)
+                done = True
+                continue
+            elif not self.aslr and l in MARKER_LINES:
+                self.slot(MARKER_LINES[l])
+            self.literal(l + "\n")
+
+        self.validate(done, closed)
+
+    def validate(self, done, closed):
+        slots = [p[0] for p in self.parts if isinstance(p, tuple)]
+        expected = [TEXT_SLOT, RODATA_SLOT]
+        if not self.aslr:
+            expected += list(LOC_MARKERS)
+
+        for name in expected:
+            if slots.count(name) != 1:
+                raise ValueError("{}: found {} insertion point(s) for {} (expected 1)".format(self.path, slots.count(name), name))
+        if closed != 2:
+            raise ValueError("{}: found {} *(.text)/*(.rodata) line(s) (expected 2)".format(self.path, closed))
+        if done:
+            raise ValueError("{}: output section of {} is not closed".format(self.path, slots[-1]))
+
+    def render(self, fragments, loc_sect=None):
+        sb = StringBuilder()
+        for p in self.parts:
+            if isinstance(p, str):
+                sb.append(p)
+            elif p[0] in LOC_MARKERS:
+                sb.append(" . = ").append("0x{:x}".format(loc_sect[LOC_MARKERS[p[0]]])).append(";\n")
+            else:
+                for f in fragments[p[0]]:
+                    sb.append(f)
+        return sb.to_str()
@@ -0,0 +1,130 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import time
+import resource
+import functools
+
+from contextlib import contextmanager
+from collections import Counter
+from utils import logger
+
+PREFIX = "spacer_"
+
+class Metrics:
+    def __init__(self):
+        self.phases = dict()
+        self.counters = Counter()
+        self.per_lib = dict()
+
+    def usage(self):
+        # CPU of the process and of its children (relink, workers), peak RSS in bytes
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+        return cpu, max(own.ru_maxrss, children.ru_maxrss) * 1024
+
+    @contextmanager
+    def phase(self, name):
+        # Phases called several times (e.g. one per cluster) are accumulated
+        wall = time.perf_counter()
+        cpu, start_rss = self.usage()
+        try:
+            yield
+        finally:
+            end_cpu, rss = self.usage()
+            p = self.phases.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_bytes": 0, "peak_rss_growth_bytes": 0, "calls": 0})
+            p["wall_seconds"] += time.perf_counter() - wall
+            p["cpu_seconds"] += end_cpu - cpu
+            # ru_maxrss is the peak of the whole process: only its increase is due to the phase
+            p["peak_rss_bytes"] = max(p["peak_rss_bytes"], rss)
+            p["peak_rss_growth_bytes"] += rss - start_rss
+            p["calls"] += 1
+
+    def timed(self, name):
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def inc(self, name, value=1, lib=None):
+        if lib is None:
+            self.counters[name] += value
+        else:
+            self.per_lib.setdefault(name, Counter())[lib] += value
+
+    def to_dict(self):
+        return {
+            "phases": self.phases,
+            "counters": dict(self.counters),
+            "per_lib": {k: dict(v) for k, v in self.per_lib.items()}
+        }
+
+    def save_json(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.to_dict(), fp, indent=4)
+        logger.info("Written metrics {}".format(path))
+
+    def save_prometheus(self, path):
+        lines = list()
+        for field, kind, desc in [("wall_seconds", "gauge", "Wall time of the phase"), ("cpu_seconds", "gauge", "CPU time of the phase (with children)"),
+                                  ("peak_rss_bytes", "gauge", "Peak RSS of the process (since its start) at the end of the phase"),
+                                  ("peak_rss_growth_bytes", "gauge", "Increase of the peak RSS of the process during the phase"), ("calls", "counter", "Number of runs of the phase")]:
+            name = "{}phase_{}".format(PREFIX, field)
+            lines.append("# HELP {} {}".format(name, desc))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for phase, p in sorted(self.phases.items()):
+                lines.append('{}{{phase="{}"}} {}'.format(name, escape(phase), p[field]))
+
+        for counter, value in sorted(self.counters.items()):
+            name = "{}{}_total".format(PREFIX, counter)
+            lines.append("# TYPE {} counter".format(name))
+            lines.append("{} {}".format(name, value))
+
+        for counter, libs in sorted(self.per_lib.items()):
+            name = "{}{}_total".format(PREFIX, counter)
+            lines.append("# TYPE {} counter".format(name))
+            for lib, value in sorted(libs.items()):
+                lines.append('{}{{lib="{}"}} {}'.format(name, escape(lib), value))
+
+        with open(path, "w") as fp:
+            fp.write("\n".join(lines) + "\n")
+        logger.info("Written metrics {}".format(path))
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Metrics of the current run
+metrics = Metrics()
@@ -0,0 +1,114 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import fcntl
+import shutil
+
+from collections import Counter
+from utils import logger, file_digest
+
+# ioctl to share the extents of a file (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+class ObjectStore:
+    def __init__(self, path, use_hardlink=True):
+        self.path = path
+        self.use_hardlink = use_hardlink
+        self.digests = dict()
+        self.counts = Counter()
+        self.sizes = Counter()
+        os.makedirs(self.path, exist_ok=True)
+
+    def digest(self, path):
+        # Digests are kept for the run (the key includes the size and mtime)
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns)
+        if key not in self.digests:
+            self.digests[key] = file_digest(path)
+        return self.digests[key]
+
+    def object_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def add(self, src):
+        digest = self.digest(src)
+        obj = self.object_path(digest)
+        if not os.path.isfile(obj):
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            # The store never shares an inode with a build folder which may be rebuilt
+            self.link(src, obj, False)
+        return digest
+
+    def link(self, src, dst, use_hardlink):
+        tmp = dst + ".tmp"
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+
+        kind = "copied"
+        try:
+            with open(src, "rb") as f_src, open(tmp, "wb") as f_dst:
+                fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+            kind = "reflinked"
+        except OSError:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            if use_hardlink:
+                try:
+                    os.link(src, tmp)
+                    kind = "hardlinked"
+                except OSError:
+                    pass
+            if kind == "copied":
+                shutil.copyfile(src, tmp)
+
+        os.replace(tmp, dst)
+        return kind
+
+    def materialize(self, digest, dst):
+        obj = self.object_path(digest)
+        size = os.path.getsize(obj)
+
+        # Skip the files which already have the same content
+        if os.path.isfile(dst) and (os.path.samefile(obj, dst) or (os.path.getsize(dst) == size and self.digest(dst) == digest)):
+            kind = "identical"
+        else:
+            kind = self.link(obj, dst, self.use_hardlink)
+
+        self.counts[kind] += 1
+        self.sizes[kind] += size
+        return kind
+
+    def report(self):
+        avoided = sum(v for k, v in self.sizes.items() if k != "copied")
+        logger.info("Objects: {} identical, {} reflinked, {} hardlinked, {} copied ({} bytes avoided, {} bytes copied)".format(
+            self.counts["identical"], self.counts["reflinked"], self.counts["hardlinked"], self.counts["copied"], avoided, self.sizes["copied"]))
+        return avoided
@@ -0,0 +1,153 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import glob
+import json
+import hashlib
+
+from collections import Counter, defaultdict
+from elftools.elf.elffile import ELFFile
+from utils import logger
+
+PAGE_SIZE    = 0x1000
+ALIGNED_UK   = "unikernel_*-x86_64_local_align{}.dbg"
+UNALIGNED_UK = "*-x86_64.dbg"
+LIB_SECTIONS = [".text.", ".rodata.", ".ind."]
+
+class UkImage:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.pages = dict()
+        self.libs = defaultdict(set)
+
+    def load(self):
+        pages = dict()
+        with open(self.path, 'rb') as f:
+            elf = ELFFile(f)
+            for seg in elf.iter_segments():
+                if seg["p_type"] != "PT_LOAD" or seg["p_memsz"] == 0:
+                    continue
+
+                # Map the segment at its virtual address (the end of memsz is zero-filled)
+                data = seg.data()
+                vaddr = seg["p_vaddr"]
+                start = vaddr - vaddr % PAGE_SIZE
+                for page in range(start, vaddr + seg["p_memsz"], PAGE_SIZE):
+                    if page not in pages:
+                        pages[page] = bytearray(PAGE_SIZE)
+                    lo = max(page, vaddr)
+                    hi = min(page + PAGE_SIZE, vaddr + len(data))
+                    if lo < hi:
+                        pages[page][lo-page:hi-page] = data[lo-vaddr:hi-vaddr]
+
+            # Microlib(s) of each page from the .text.<lib>/.rodata.<lib> sections
+            for sec in elf.iter_sections():
+                prefix = next((p for p in LIB_SECTIONS if sec.name.startswith(p)), None)
+                if prefix is None or sec["sh_addr"] == 0 or sec["sh_size"] == 0:
+                    continue
+                lib = sec.name[len(prefix):]
+                start = sec["sh_addr"] - sec["sh_addr"] % PAGE_SIZE
+                for page in range(start, sec["sh_addr"] + sec["sh_size"], PAGE_SIZE):
+                    self.libs[page].add(lib)
+
+        for page, content in pages.items():
+            self.pages[page] = hashlib.sha1(content).digest()
+        return self
+
+def find_images(workspace, uks_included, pattern):
+    images = list()
+    for d in sorted(os.listdir(workspace)):
+        if d not in uks_included:
+            continue
+        paths = sorted(p for p in glob.glob(os.path.join(workspace, d, "build", pattern)) if pattern != UNALIGNED_UK or "local_align" not in p)
+        if len(paths) == 0:
+            logger.warning("No image {} found for {}".format(pattern, d))
+            continue
+        images.append(UkImage(d, paths[0]).load())
+    return images
+
+def estimate(images):
+    # Identical pages are merged whatever their address (as KSM does)
+    occurences = Counter()
+    instances = defaultdict(set)
+    for img in images:
+        for page, digest in img.pages.items():
+            occurences[digest] += 1
+            instances[digest].add(img.name)
+
+    total = sum(occurences.values())
+    unique = len(occurences)
+    shared_by = Counter(len(v) for v in instances.values())
+
+    libs = defaultdict(lambda: {"pages": 0, "unique": set()})
+    for img in images:
+        for page, digest in img.pages.items():
+            for lib in img.libs.get(page, []):
+                libs[lib]["pages"] += 1
+                libs[lib]["unique"].add(digest)
+
+    return {
+        "instances": len(images),
+        "total_pages": total,
+        "unique_pages": unique,
+        "saved_pages": total - unique,
+        "shared_by": {str(k): shared_by[k] for k in sorted(shared_by)},
+        "libs": {k: {"pages": v["pages"], "unique_pages": len(v["unique"]), "saved_pages": v["pages"] - len(v["unique"])} for k, v in sorted(libs.items())}
+    }
+
+def display_report(name, report):
+    logger.info("[{}] {} instances: {} pages, {} unique, {} saved ({} KB)".format(name, report["instances"], report["total_pages"], report["unique_pages"], report["saved_pages"], report["saved_pages"] * PAGE_SIZE // 1024))
+    for k, v in report["shared_by"].items():
+        logger.info("[{}]   pages shared by {:>4} instances: {}".format(name, k, v))
+    for lib, v in report["libs"].items():
+        logger.info("[{}]   {:<32} {:>6} pages, {:>6} unique, {:>6} saved".format(name, lib, v["pages"], v["unique_pages"], v["saved_pages"]))
+
+def estimate_fleet(workspace, uks_included, aslr, json_file=None):
+
+    aligned = estimate(find_images(workspace, uks_included, ALIGNED_UK.format("_aslr" if aslr > 0 else "")))
+    display_report("aligned", aligned)
+    results = {"aligned": aligned}
+
+    images = find_images(workspace, uks_included, UNALIGNED_UK)
+    if len(images) > 0:
+        unaligned = estimate(images)
+        display_report("unaligned", unaligned)
+        results["unaligned"] = unaligned
+        results["expected_savings"] = aligned["saved_pages"] - unaligned["saved_pages"]
+        logger.info("Expected savings versus the unaligned builds: {} pages ({} KB)".format(results["expected_savings"], results["expected_savings"] * PAGE_SIZE // 1024))
+
+    if json_file is not None:
+        with open(json_file, "w") as fp:
+            json.dump(results, fp, indent=4)
+        logger.info("Written {}".format(json_file))
+    return results
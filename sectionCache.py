@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import json
+
+from utils import logger, file_digest
+
+CACHE_VERSION     = 1
+CACHE_MAX_ENTRIES = 100000
+
+class SectionCache:
+    def __init__(self, path, s_name, max_entries=CACHE_MAX_ENTRIES, use_hash=False):
+        self.path = path
+        self.s_name = list(s_name)
+        self.max_entries = max_entries
+        self.use_hash = use_hash
+        self.entries = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r") as json_file:
+                data = json.load(json_file)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignore section cache {} ({})".format(self.path, e))
+            return
+
+        # Another layout of sections invalidates the whole cache
+        if data.get("version") != CACHE_VERSION or data.get("sections") != self.s_name:
+            logger.warning("Ignore outdated section cache {}".format(self.path))
+            return
+        self.entries = data.get("entries", dict())
+
+    def get(self, path):
+        entry = self.entries.get(path)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        st = os.stat(path)
+        valid = entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns
+        if not valid and self.use_hash and entry["size"] == st.st_size and entry.get("hash") is not None:
+            # Same content with another mtime (e.g., the object was rebuilt)
+            valid = entry["hash"] == file_digest(path)
+            if valid:
+                entry["mtime"] = st.st_mtime_ns
+
+        if not valid:
+            # Stale entry
+            del self.entries[path]
+            self.evicted += 1
+            self.misses += 1
+            return None
+
+        # Move the entry to the end (most recently used)
+        self.entries[path] = self.entries.pop(path)
+        self.hits += 1
+        return entry["filetype"], [tuple(sec) if sec is not None else None for sec in entry["sections"]]
+
+    def put(self, path, info):
+        st = os.stat(path)
+        filetype, sections = info
+        self.entries.pop(path, None)
+        self.entries[path] = {
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "hash": file_digest(path) if self.use_hash else None,
+            "filetype": filetype,
+            "sections": [list(sec) if sec is not None else None for sec in sections]
+        }
+
+    def save(self):
+        # Remove entries of deleted files and then the least recently used ones
+        for path in [p for p in self.entries if not os.path.isfile(p)]:
+            del self.entries[path]
+            self.evicted += 1
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+            self.evicted += 1
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump({"version": CACHE_VERSION, "sections": self.s_name, "entries": self.entries}, fp)
+        os.replace(tmp, self.path)
+        logger.info("Section cache: {} hits, {} misses, {} evicted ({} entries)".format(self.hits, self.misses, self.evicted, len(self.entries)))
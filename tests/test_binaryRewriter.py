@@ -0,0 +1,109 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip("capstone")
+pytest.importorskip("lief")
+
+from capstone import Cs, CS_ARCH_X86, CS_MODE_64
+from aslr.binary_rewriter import Unikernel, Section, AddrIndex, classify_operands, classify_regex, rewrite_binary
+
+TEXT = 0x200000
+DATA = 0x201000
+
+@pytest.fixture
+def unikernel():
+    uk = Unikernel("uk")
+    uk.sections = [Section(".text.libfoo", TEXT, 0x1000, 0x1000, 0x1000), Section(".data", DATA, 0x2000, 0x1000, 0x1000)]
+    uk.index = AddrIndex(uk.sections)
+    return uk
+
+def classify(uk, code):
+    md = Cs(CS_ARCH_X86, CS_MODE_64)
+    md.detail = True
+    ins = next(md.disasm(code, TEXT + 0x10))
+    return classify_operands(uk, ins, uk.sections[0]), classify_regex(uk, ins, uk.sections[0])
+
+@pytest.mark.parametrize("code", [
+    bytes.fromhex("488b04c500102000"),     # mov rax, qword ptr [rax*8 + 0x201000]
+    bytes.fromhex("8b8300102000"),         # mov eax, dword ptr [rbx + 0x201000]
+    bytes.fromhex("8b840b00102000"),       # mov eax, dword ptr [rbx + rcx + 0x201000]
+    bytes.fromhex("8b042500102000"),       # mov eax, dword ptr [0x201000]
+], ids=["index", "base", "base_index", "absolute"])
+def test_absolute_displacement(unikernel, code):
+    operands, regex = classify(unikernel, code)
+    assert operands == regex == (DATA, "absolute")
+
+def test_small_displacement(unikernel):
+    # mov eax, dword ptr [rbx + 0x10] (disp32)
+    operands, regex = classify(unikernel, bytes.fromhex("8b8310000000"))
+    assert operands == regex == (None, None)
+
+# Two microlibs referencing a global: the .ind of the second one is too small
+SOURCE = """
+int counter;
+void incr(void) { counter += 1; }
+"""
+
+LDS = """
+SECTIONS
+{
+    . = 0x200000;
+    .text.libfoo : { foo.o(.text) }
+    .ind.libfoo : { BYTE(0x90) . = ALIGN(0x1000); }
+    .text.libbar : { bar.o(.text) }
+    .ind.libbar : { BYTE(0x90) }
+    .data : { *(.data*) }
+    .bss : { *(.bss*) *(COMMON) }
+    /DISCARD/ : { *(.note*) *(.comment) *(.eh_frame) }
+}
+"""
+
+def test_inplace_overflow(tmp_path):
+    if shutil.which("gcc") is None or shutil.which("ld") is None:
+        pytest.skip("gcc and ld are required")
+    (tmp_path / "foo.c").write_text(SOURCE)
+    (tmp_path / "bar.c").write_text(SOURCE.replace("int counter", "extern int counter").replace("incr", "decr").replace("+=", "-="))
+    (tmp_path / "link.lds").write_text(LDS)
+    for name in ["foo", "bar"]:
+        subprocess.check_call(["gcc", "-O2", "-fno-pic", "-c", name + ".c", "-o", name + ".o"], cwd=tmp_path)
+    subprocess.check_call(["ld", "-T", "link.lds", "-e", "0", "foo.o", "bar.o", "-o", "uk.dbg"], cwd=tmp_path)
+
+    path = tmp_path / "uk.dbg"
+    before = path.read_bytes()
+    with pytest.raises(ValueError, match="ind.libbar"):
+        rewrite_binary(str(path), False, inplace=True)
+    # .text.libfoo fits in its .ind but is not written either
+    assert path.read_bytes() == before
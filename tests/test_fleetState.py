@@ -0,0 +1,103 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+from fleetState import FleetState
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+from fleetGenerator import generate_fleet
+
+def aligner(workspace, *args):
+    return subprocess.run([sys.executable, os.path.join(ROOT, "aligner.py"), "-w", str(workspace) + "/", "-r", "0", "-o", "1", "-v", "0"] + list(args),
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+@pytest.fixture
+def fleet(tmp_path):
+    uks = generate_fleet(str(tmp_path), 4, n_libs=24, per_uk=8, common=2)
+    return tmp_path, uks
+
+def combine(workspace, name, uks):
+    # New unikernel with the libs of several unikernels of the fleet (and the app of the first one)
+    build = os.path.join(str(workspace), "apps", name, "build")
+    shutil.copytree(os.path.join(str(workspace), "apps", uks[0], "build"), build)
+    for uk in uks[1:]:
+        src = os.path.join(str(workspace), "apps", uk, "build")
+        for obj in os.listdir(src):
+            if obj.startswith("lib") and obj.endswith(".o"):
+                shutil.copyfile(os.path.join(src, obj), os.path.join(build, obj))
+
+def test_add_new_libs_with_data(fleet):
+    workspace, uks = fleet
+    state = str(workspace / "fleet.json")
+    p = aligner(workspace, "-u", *uks[:2], "--state", state, "--reserve", str(0x40000))
+    assert p.returncode == 0, p.stdout
+    assert FleetState.load(state).reserve == 0x40000
+
+    # .data and .bss of the new unikernel are bigger than the ones of the fleet
+    combine(workspace, "uk-new", uks[:3])
+    p = aligner(workspace, "-u", *uks[:2], "--state", state, "--add", "uk-new")
+    assert p.returncode == 0, p.stdout
+    assert "uk-new" in FleetState.load(state).unikernels
+
+@pytest.fixture
+def state():
+    # liba at 0x200000 (0x1000 bytes) in uk-a, free space from 0x210000
+    state = FleetState()
+    state.libs["liba"] = {"size": {".text": 0x1000, ".rodata": 0}, "users": ["uk-a"], "obj": None}
+    state.unikernels["uk-a"] = {".text": {"liba": 0x200000}, ".rodata": dict()}
+    state.add_slot("liba", ".text", 0x200000, 0x1000)
+    state.gaps[".text"] = [0x210000, 0x220000]
+    return state
+
+def test_place_in_slot(state):
+    assert state.place("liba", ".text", 0x800, 16, list()) == 0x200000
+    # A bigger version of the lib does not fit in the slot of 0x200000
+    assert state.place("liba", ".text", 0x1800, 16, list()) == 0x210000
+    assert state.slot("liba", ".text", 0x210000) == 0x1800
+
+    # Even when the known size of the lib is raised (by an add)
+    state.libs["liba"]["size"][".text"] = 0x1800
+    state.unikernels["uk-b"] = {".text": {"liba": 0x210000}, ".rodata": dict()}
+    state.unikernels["uk-c"] = {".text": {"liba": 0x200000}, ".rodata": dict()}
+    assert state.place("liba", ".text", 0x1800, 16, list()) == 0x210000
+    assert state.place("liba", ".text", 0x2000, 16, list()) == 0x212000
+
+def test_place_overlap(state):
+    # The slot and the gap are both used by other libs of the unikernel
+    placed = [(0x200000, 0x201000), (0x210000, 0x211000)]
+    assert state.place("liba", ".text", 0x800, 16, placed) is None
@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#
+# Authors: Gaulthier Gain <gaulthier.gain@uliege.be>
+#
+# Copyright (c) 2020-2023, University of Liège. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip("capstone")
+pytest.importorskip("elftools")
+pytest.importorskip("lief")
+
+from indPredictor import predict_ind_size
+from aslr import binary_rewriter
+
+# The address of a static function of the same object is an absolute relocation into its own .text
+SOURCE = """
+static int __attribute__((noinline)) helper(int x) { return x * 3 + 1; }
+static int __attribute__((noinline)) other(int x) { return x - 7; }
+int (*table[2])(int);
+
+int (*pick(int n))(int) { return n ? helper : other; }
+void fill(void) { table[0] = helper; table[1] = other; }
+"""
+
+# One microlib (.text.libfoo) followed by its indirection section
+LDS = """
+SECTIONS
+{
+    . = 0x200000;
+    .text.libfoo : { foo.o(.text) }
+    . = ALIGN(0x1000);
+    .ind.libfoo : { BYTE(0x90) . = ALIGN(0x1000); }
+    .rodata : { *(.rodata*) }
+    .data : { *(.data*) }
+    .bss : { *(.bss*) *(COMMON) }
+    /DISCARD/ : { *(.note*) *(.comment) *(.eh_frame) }
+}
+"""
+
+@pytest.fixture
+def unikernel(tmp_path):
+    if shutil.which("gcc") is None or shutil.which("ld") is None:
+        pytest.skip("gcc and ld are required")
+    (tmp_path / "foo.c").write_text(SOURCE)
+    (tmp_path / "link.lds").write_text(LDS)
+    subprocess.check_call(["gcc", "-O2", "-fno-pic", "-c", "foo.c", "-o", "foo.o"], cwd=tmp_path)
+    subprocess.check_call(["ld", "-T", "link.lds", "-e", "0", "foo.o", "-o", "foo.dbg"], cwd=tmp_path)
+    return tmp_path
+
+def test_static_function_address(unikernel):
+    size, count = predict_ind_size(str(unikernel / "foo.o"))
+    assert count >= 2
+
+    sizes, counters = binary_rewriter.rewrite_binary(str(unikernel / "foo.dbg"), False, inplace=True)
+    assert counters["rewritten"] >= 2
+    assert size >= int(sizes[".text.libfoo"], 16)
@@ -30,19 +30,55 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import os
-import re
 import sys
+import copy
 import json
 import time
+import math
 import shlex
 import random
 import shutil
 import subprocess
 
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from unikernels import *
-from aslr import binary_rewriter
-from utils import round_to_n, logger, SUCCESS, LDS_VFSCORE, LDS_NETDEV, LDS_UKS
+from sectionCache import SectionCache
+from objectStore import ObjectStore
+from fleetState import FleetState, LAYOUT_SECT
+from linkerScript import LinkTemplate, TEXT_SLOT, RODATA_SLOT
+from aslr import JSON_MAPS_FILE, JSON_PREDICTIONS_FILE
+from indPredictor import predict_worker, load_predictions, save_predictions
+from utils import round_to_n, logger, file_digest, SUCCESS, LDS_VFSCORE, LDS_NETDEV, LDS_UKS
 from stringBuilder import StringBuilder
+from metrics import metrics
+
+# Indirection sizes and predictions (independent of the working directory)
+ASLR_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "aslr")
+
+def run_relink(name, path, cmd):
+    # Each job runs in its own working directory (no global chdir)
+    start = time.time()
+    p = subprocess.run(shlex.split(cmd), cwd=path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    return name, p.returncode, time.time() - start, p.stderr
+
+def load_aslr_backend():
+    # lief and capstone are only imported when aslr is used
+    try:
+        from aslr import binary_rewriter
+    except ImportError as e:
+        logger.fatal("The aslr backend requires lief and capstone - {}".format(e))
+        sys.exit(1)
+    return binary_rewriter
+
+def run_rewrite(name, ukname, inplace=False, trace_file=None):
+    from aslr import binary_rewriter
+    start = time.time()
+    try:
+        sizes, counters = binary_rewriter.rewrite_binary(ukname, False, inplace=inplace, trace_file=trace_file)
+    except Exception as e:
+        return name, None, None, time.time() - start, e
+    return name, sizes, counters, time.time() - start, None
 
 class UkManager:
     def __init__(self, args):
@@ -55,6 +91,21 @@ class UkManager:
         self.align_text = args.align
         self.copy_objs = args.copy_objs
         self.aslr = args.aslr
+        self.aslr_inplace = args.aslr_inplace
+        self.aslr_trace = args.aslr_trace
+        self.jobs = args.jobs
+        self.pack = args.pack
+        self.padding = dict(page=0, packed=0)
+        self.state_file = args.state
+        self.reserve = args.reserve
+        self.placements = dict()
+        self.gaps = dict()
+        self.cache = None
+        if args.cache:
+            self.cache = SectionCache(args.cache, SEC_NAME, args.cache_size, args.cache_hash)
+        self.store = None
+        if args.store:
+            self.store = ObjectStore(args.store, args.store_hardlink)
         self.common_to_all = dict()
         self.common_subset = dict()
         self.objs_files = dict()
@@ -62,19 +113,136 @@ class UkManager:
         self.global_maps = dict()
         self.loc_sect = dict()
         self.sb_link = dict()
+        self.relink_jobs = list()
+        self.templates = dict()
+        self.ind_reserved = dict()
 
-    def process_folder(self):
+    @metrics.timed("scan")
+    def process_folder(self, sections_info=None):
         for d in os.listdir(self.workspace):
             if d in self.uks_included:
-                uk = Unikernel(d, os.path.join(self.workspace, d))
-                logger.info("Process {} ".format(d))
-                uk.process_build_folder(os.path.join(self.workspace, d, "build/"), self.global_maps, self.objs_files)
-                self.uks.append(uk)
+                self.uks.append(Unikernel(d, os.path.join(self.workspace, d)))
+
+        # Read the object files (cache and/or in parallel), then merge them in the serial order
+        # (sections_info: sections already read by the caller, e.g. the daemon)
+        if sections_info is None and (self.jobs > 1 or self.cache is not None):
+            sections_info = self.scan_objects()
+
+        for uk in self.uks:
+            logger.info("Process {} ".format(uk.name))
+            uk.process_build_folder(os.path.join(uk.workspace, "build/"), self.global_maps, self.objs_files, sections_info=sections_info)
         
         if len(self.uks) <= 1:
             logger.fatal("At least 2 unikernels instances are required. Found: {}".format(len(self.uks)))
             sys.exit(1)
 
+    def scan_objects(self):
+        paths = list()
+        for uk in self.uks:
+            path = os.path.join(uk.workspace, "build/")
+            paths.extend(path + lib for lib in uk.list_objects(path))
+
+        sections_info = dict()
+        if self.cache is not None:
+            for p in paths:
+                info = self.cache.get(p)
+                if info is not None:
+                    sections_info[p] = info
+        missing = [p for p in paths if p not in sections_info]
+        metrics.inc("cache_hits", len(paths) - len(missing))
+        metrics.inc("objects_parsed", len(missing))
+        metrics.inc("object_bytes_parsed", sum(os.path.getsize(p) for p in missing))
+
+        logger.info("Scan {} objects with {} jobs".format(len(missing), self.jobs))
+        if self.jobs > 1 and len(missing) > 1:
+            chunksize = max(1, len(missing) // (self.jobs * 4))
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                infos = list(executor.map(read_sections, missing, repeat(SEC_NAME), chunksize=chunksize))
+        else:
+            infos = [read_sections(p, SEC_NAME) for p in missing]
+
+        for p, info in zip(missing, infos):
+            sections_info[p] = info
+            if self.cache is not None:
+                self.cache.put(p, info)
+
+        if self.cache is not None:
+            self.cache.save()
+        return sections_info
+
+    def split_clusters(self, threshold):
+
+        # Leader clustering of the unikernels on the Jaccard similarity of their libs
+        clusters = list()
+        for uk in sorted(self.uks, key=lambda uk: len(uk.objects), reverse=True):
+            libs = set(uk.objects)
+            best, best_sim = None, threshold
+            for leader, members in clusters:
+                sim = len(libs & leader) / len(libs | leader)
+                if sim >= best_sim:
+                    best, best_sim = members, sim
+            if best is None:
+                clusters.append((libs, [uk]))
+            else:
+                best.append(uk)
+
+        # Each cluster is aligned independently (with the sizes of the whole fleet)
+        managers = list()
+        for _, members in clusters:
+            names = set(uk.name for uk in members)
+            sub = copy.copy(self)
+            sub.uks = [uk for uk in self.uks if uk.name in names]
+            sub.global_maps = dict()
+            for name, ukLib in self.global_maps.items():
+                occurence = sum(1 for uk in sub.uks if name in uk.objects)
+                if occurence > 0:
+                    sub.global_maps[name] = copy.copy(ukLib)
+                    sub.global_maps[name].occurence = occurence
+            sub.common_to_all = dict()
+            sub.common_subset = dict()
+            sub.indivial = dict()
+            sub.loc_sect = dict()
+            sub.sb_link = dict()
+            sub.relink_jobs = list()
+            sub.placements = dict()
+            sub.gaps = dict()
+            sub.padding = dict(page=0, packed=0)
+            sub.state_file = None
+            if self.state_file is not None:
+                # One state per cluster (fleet.json -> fleet.cluster1.json), to add unikernels to a cluster
+                root, ext = os.path.splitext(self.state_file)
+                sub.state_file = "{}.cluster{}{}".format(root, len(managers) + 1, ext)
+            managers.append(sub)
+            logger.info("Cluster {}: {}".format(len(managers), ", ".join(uk.name for uk in sub.uks)))
+
+        return managers
+
+    def report_clusters(self, managers):
+
+        # Addresses of each lib (per section) in every unikernel of every cluster
+        addrs = dict()
+        for i, sub in enumerate(managers):
+            for uk in sub.uks:
+                for type_sect in LAYOUT_SECT:
+                    for lib in uk.objects:
+                        addr = sub.placements.get(type_sect, dict()).get(lib, uk.placements.get(type_sect, dict()).get(lib))
+                        if addr is not None:
+                            addrs.setdefault((type_sect, lib), list()).append((i, addr))
+
+        # Shared: instances of a lib at the same address. Lost: extra copies only due to other clusters
+        shared = 0
+        lost = 0
+        for (type_sect, lib), values in addrs.items():
+            pages = math.ceil(self.global_maps[lib].total_size[type_sect] / PAGE_SIZE)
+            distinct = len(set(addr for _, addr in values))
+            per_cluster = max(len(set(addr for c, addr in values if c == i)) for i in set(c for c, _ in values))
+            shared += pages * (len(values) - distinct)
+            lost += pages * (distinct - per_cluster)
+
+        logger.info("{} clusters: {} pages shared, {} pages lost across clusters".format(len(managers), shared, lost))
+        return shared, lost
+
+    @metrics.timed("classify")
     def process_maps(self):
         for k,v in self.global_maps.items():
             if v.occurence == len(self.uks):
@@ -86,6 +254,8 @@ class UkManager:
 
     def process_common_to_all(self, type_sect):
         sb = StringBuilder()
+        start = self.loc_counter
+        used = 0
         for _, ukLib in self.common_to_all.items():
 
             if ukLib.total_size[type_sect] == 0:
@@ -95,24 +265,57 @@ class UkManager:
             if ".text" not in type_sect:
                 # Get the alignment of the section (.rodata)
                 self.loc_counter = round_to_n(self.loc_counter, ukLib.sections[type_sect].addralign)
+            elif self.pack:
+                # Common libs are all used together: keep only the alignment of .text
+                self.loc_counter = round_to_n(self.loc_counter, max(1, ukLib.sections[type_sect].addralign))
 
+            self.placements.setdefault(type_sect, dict())[ukLib.name] = self.loc_counter
             sb.append("  ").append(type_sect).append(".").append(ukLib.name).append(" 0x{:x} : ".format(self.loc_counter)).append("{ ").append(ukLib.name).append(OBJ_EXT).append("(").append(type_sect).append("); }\n")
             
-            if  ".text" in type_sect and self.align_text:
+            if ".text" in type_sect and self.pack:
+                self.loc_counter += ukLib.total_size[type_sect]
+                used += ukLib.total_size[type_sect]
+                self.padding["page"] += (round_to_n(ukLib.total_size[type_sect], PAGE_SIZE) - ukLib.total_size[type_sect]) * len(self.uks)
+            elif  ".text" in type_sect and self.align_text:
                 # Align common lib on pages boundary (instead of compacting) -> only for .text
                 self.loc_counter = round_to_n(self.loc_counter+ukLib.total_size[type_sect], PAGE_SIZE)
             else:
                 self.loc_counter += ukLib.total_size[type_sect]
+
+        if ".text" in type_sect and self.pack:
+            # A single page boundary after all the common libs
+            self.loc_counter = round_to_n(self.loc_counter, PAGE_SIZE)
+            self.padding["packed"] += (self.loc_counter - start - used) * len(self.uks)
                 
         return sb.to_str()
 
+    def sharing_groups(self, subset):
+        # Group the libs by the set of unikernels that use them
+        groups = dict()
+        for name, ukLib in subset.items():
+            users = frozenset(uk.name for uk in self.uks if name in uk.objects)
+            groups.setdefault(users, list()).append(ukLib)
+        return groups
+
     def compute_loc(self, type_sect, subset):
+        for uk in self.uks:
+            uk.sb_link.setdefault(type_sect, StringBuilder())
+
         if len(subset) == 0:
             return
 
+        groups = None
+        if ".text" in type_sect and self.pack:
+            groups = self.sharing_groups(subset)
+
         for uk in self.uks:
             uk.loc_counter = self.loc_counter
-            uk.update_loc_counter(type_sect, subset)
+            if groups is not None:
+                page, packed = uk.update_loc_counter_packed(type_sect, groups)
+                self.padding["page"] += page
+                self.padding["packed"] += packed
+            else:
+                uk.update_loc_counter(type_sect, subset)
 
         if ".text" in type_sect:
             self.loc_counter = round_to_n(max(uk.loc_counter for uk in self.uks), PAGE_SIZE)
@@ -128,11 +331,140 @@ class UkManager:
             logger.fatal("aslr must either be 0, 1 or 2. Found: {}".format(len(self.uks)))
             sys.exit(1)
             
+    def layout_plan(self, use_custom_loader):
+
+        # Only the layout: no link file is written and nothing is relinked
+        if self.aslr == 0:
+            self.compute_layout_spacer(use_custom_loader)
+        elif self.aslr == 1 or self.aslr == 2:
+            return self.layout_plan_aslr(self.compute_layout_aslr())
+        else:
+            logger.fatal("aslr must either be 0, 1 or 2. Found: {}".format(self.aslr))
+            sys.exit(1)
+
+        plan = {
+            "aslr": self.aslr,
+            "loc_sect": dict(self.loc_sect),
+            "common": {k: dict(self.placements.get(k, dict())) for k in LAYOUT_SECT},
+            "gaps": self.gaps,
+            "unikernels": dict()
+        }
+        if self.pack:
+            plan["padding"] = dict(self.padding)
+
+        for uk in self.uks:
+            sections = dict()
+            padding = dict()
+            for k in LAYOUT_SECT:
+                placed = {lib: addr for lib, addr in self.placements.get(k, dict()).items() if lib in uk.objects}
+                placed.update(uk.placements.get(k, dict()))
+                sections[k] = dict(sorted(placed.items(), key=lambda x: x[1]))
+
+                # Bytes between the libs of the unikernel
+                padding[k] = 0
+                ends = [(addr, addr + self.global_maps[lib].total_size[k]) for lib, addr in sections[k].items()]
+                for (_, end), (start, _) in zip(ends, ends[1:]):
+                    padding[k] += start - end
+
+            for k, end in [(".data", ".bss"), (".bss", ".intrstack")]:
+                padding[k] = self.loc_sect[end] - self.loc_sect[k] - uk.total_size.get(k, 0)
+
+            plan["unikernels"][uk.name] = {
+                "sections": sections,
+                "padding": padding,
+                "total_size": {k: uk.total_size.get(k, 0) for k in [".data", ".bss"]}
+            }
+            logger.info("Plan {:<32} (padding: {})".format(uk.name, ", ".join("{}={}".format(k, v) for k, v in padding.items())))
+
+        return plan
+
+    @metrics.timed("predict")
+    def predict_ind_sizes(self):
+
+        # Upper bound of the .ind of each lib from its object (before linking), cached by content
+        json_file = os.path.join(ASLR_DIR, JSON_PREDICTIONS_FILE)
+        cache = load_predictions(json_file)
+
+        digests = dict()
+        for uk in self.uks:
+            for lib in uk.objects:
+                path = os.path.join(uk.workspace, "build", lib + OBJ_EXT)
+                if not lib.startswith("app") and os.path.isfile(path):
+                    digests[(uk.name, lib)] = (file_digest(path), path)
+
+        missing = dict()
+        for digest, path in digests.values():
+            if digest not in cache:
+                missing[digest] = path
+
+        logger.info("Predict the .ind size of {} objects with {} jobs".format(len(missing), self.jobs))
+        if self.jobs > 1 and len(missing) > 1:
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                results = list(executor.map(predict_worker, missing.values()))
+        else:
+            results = [predict_worker(path) for path in missing.values()]
+
+        for digest, (result, error) in zip(missing, results):
+            if error is not None:
+                logger.warning("No .ind prediction ({}), use {}".format(error, JSON_MAPS_FILE))
+                continue
+            cache[digest] = "0x{:x}".format(result[0])
+            metrics.inc("ind_predictions")
+        if len(missing) > 0:
+            save_predictions(json_file, cache)
+
+        return {k: int(cache[digest], 16) for k, (digest, _) in digests.items() if digest in cache}
+
+    def layout_plan_aslr(self, layouts):
+        plan = {
+            "aslr": self.aslr,
+            "rodata_common": [ukLib.name for ukLib in self.common_to_all.values()],
+            "unikernels": dict()
+        }
+        for uk in self.uks:
+            plan["unikernels"][uk.name] = {
+                "text": [{"lib": lib, "ind": size_ind} for lib, size_ind in layouts[uk.name]["text"]],
+                "rodata": layouts[uk.name]["rodata"]
+            }
+        return plan
+
+    def save_plan(self, path, plan):
+        with open(path, "w") as fp:
+            json.dump(plan, fp, indent=4)
+        logger.info("Written layout plan {}".format(path))
+
     def update_link_file_aslr(self):
-        
+
+        layouts = self.compute_layout_aslr()
+        for uk in self.uks:
+            libs = list()
+            for ukLib, size_ind in layouts[uk.name]["text"]:
+                if size_ind is None:
+                    libs.append(".text.{} : ALIGN(0x1000){{ {}{}(.text); }}\n".format(ukLib, ukLib, OBJ_EXT))
+                else:
+                    libs.append(".text.{} : ALIGN(0x1000){{ {}{}(.text); }}\n.ind.{} : ALIGN(0x1000) {{ BYTE(1);. += 0x{:x}-1; }}\n".format(ukLib, ukLib, OBJ_EXT, ukLib, size_ind))
+            self.sb_link[".text"] = ''.join(libs)
+
+            self.sb_link[".rodata_uk"] = StringBuilder()
+            for ukLib in layouts[uk.name]["rodata"]:
+                self.sb_link[".rodata_uk"].append(".rodata.{} : ALIGN(0x1000) {{ {}{}(.rodata); }}\n".format(ukLib, ukLib, OBJ_EXT))
+
+            plat = "lib" + uk.kvm_plat + "plat"
+            path = os.path.join(self.workspace, uk.name, "build")
+            with metrics.phase("write"), open(os.path.join(path, plat, "link64_out_aslr.lds"), "w") as file_out:
+                file_out.write(self.process_link64_spacer_aslr(uk))
+                logger.info("Written link64_out_aslr.lds in {}/ ".format(path + "/" + plat))
+            if self.must_relink:
+                self.relink(uk.name, path, uk.use_vfscore, uk.kvm_plat)
+
+        self.relink_all()
+
+    @metrics.timed("layout")
+    def compute_layout_aslr(self):
+
         maps_size_libs = dict()
         try:
-            with open(os.path.join("aslr", binary_rewriter.JSON_MAPS_FILE)) as json_file:
+            with open(os.path.join(ASLR_DIR, JSON_MAPS_FILE)) as json_file:
                 maps_size_libs = json.load(json_file)
         except:
             logger.warning("No json file found. Continue with empty map size.")
@@ -143,59 +475,102 @@ class UkManager:
             self.sb_link[".rodata"].append("  {}{}(.rodata);\n".format(ukLib.name, OBJ_EXT))
         self.sb_link[".rodata"].append("}\n")
         
+        predicted = self.predict_ind_sizes()
+
+        # Order of the .text sections with the size of their indirection table (None: no table)
+        layouts = dict()
         app_lib = None
         logger.info("Processing the mapping for {} unikernels".format(len(self.uks)))
         for uk in self.uks:
             libs = list()
-            self.sb_link[".rodata_uk"] = StringBuilder()
+            rodata = list()
+            self.ind_reserved[uk.name] = dict()
             for ukLib in uk.objects:
                 
                 size_ind = 0x1000
                 key = '.text.' + ukLib
-                if key in maps_size_libs:
+                if (uk.name, ukLib) in predicted:
+                    # At least one byte (BYTE(1) in the link file)
+                    size_ind = max(1, predicted[(uk.name, ukLib)])
+                elif key in maps_size_libs:
                     size_ind=int(maps_size_libs[key], 16)
+                self.ind_reserved[uk.name][key] = size_ind
                 
                 if ukLib.startswith("app"):
                     app_lib=ukLib
                 else:
-                    libs.append(".text.{} : ALIGN(0x1000){{ {}{}(.text); }}\n.ind.{} : ALIGN(0x1000) {{ BYTE(1);. += 0x{:x}-1; }}\n".format(ukLib, ukLib, OBJ_EXT, ukLib, size_ind))
+                    libs.append((ukLib, size_ind))
                 
                 if ukLib in self.common_subset or ukLib in self.indivial:
-                    self.sb_link[".rodata_uk"].append(".rodata.{} : ALIGN(0x1000) {{ {}{}(.rodata); }}\n".format(ukLib, ukLib, OBJ_EXT))
+                    rodata.append(ukLib)
 
             if self.aslr == 2:
                 libs = random.sample(libs, len(libs))
 
             if app_lib != None:
-                libs.append(".text.{} : ALIGN(0x1000){{ {}{}(.text); }}\n".format(app_lib, app_lib, OBJ_EXT))
-            
-            self.sb_link[".text"] = ''.join(libs)
-            
-            plat = "lib" + uk.kvm_plat + "plat"
-            path = os.path.join(self.workspace, uk.name, "build")
-            with open(os.path.join(path, plat, "link64.lds"), "r") as file_in, open(os.path.join(path, plat, "link64_out_aslr.lds"), "w") as file_out:
-                file_out.write(self.process_link64_spacer_aslr(file_in.read().splitlines(), uk))
-                logger.info("Written link64_out_aslr.lds in {}/ ".format(path + "/" + plat))
-            if self.must_relink:
-                self.relink(path, uk.use_vfscore, uk.kvm_plat)
-                
+                libs.append((app_lib, None))
+
+            layouts[uk.name] = {"text": libs, "rodata": rodata}
+
+        return layouts
+
+    @metrics.timed("rewrite")
     def binary_rewrite(self):
         
-        os.chdir(os.path.dirname(os.path.realpath(__file__)))
-        
+        binary_rewriter = load_aslr_backend()
+        json_file = os.path.join(ASLR_DIR, JSON_MAPS_FILE)
+        maps_size_libs = binary_rewriter.load_maps_size(json_file)
+
+        jobs = list()
         for uk in self.uks:
             logger.info("Perform Binary rewriting of {}_aslr".format(uk.name))
             ukname = os.path.join(uk.workspace, "build/unikernel_kvmfc-x86_64_local_align_aslr.dbg")
-            try:
-                start = time.time()
-                binary_rewriter.rewrite_uk(ukname, os.path.join("aslr",binary_rewriter.JSON_MAPS_FILE) , False)
-                end = time.time()
-                logger.info("Binary rewriting {:<32} (time: {}) {} ".format(uk.name + "_aslr", end-start, SUCCESS))
-            except Exception as e:
-                logger.error("Binary rewriting failed ({}) - {}".format(uk.name, e))
+            jobs.append((uk.name, ukname, self.aslr_inplace, ukname + ".trace.jsonl" if self.aslr_trace else None))
+
+        if self.jobs > 1:
+            # One unikernel per worker, the sizes are merged by the parent
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                results = list(executor.map(run_rewrite, *zip(*jobs)))
+        else:
+            results = [run_rewrite(*job) for job in jobs]
+
+        for name, sizes, counters, elapsed, e in results:
+            if e is not None:
+                logger.error("Binary rewriting failed ({}) - {}".format(name, e))
+                metrics.inc("rewrite_failures")
+                continue
+            binary_rewriter.update_maps_size(maps_size_libs, sizes)
+            metrics.inc("rewritten_unikernels")
+            for sect, value in sizes.items():
+                reserved = self.ind_reserved.get(name, dict()).get(sect)
+                if reserved is not None and int(value, 16) > reserved:
+                    logger.error("Overflow of {} in {}: 0x{:x} bytes for 0x{:x} reserved".format(sect.replace(".text", ".ind"), name, int(value, 16), reserved))
+                    metrics.inc("ind_overflows")
+            for k in ["instructions", "rewritten", "trampolines"]:
+                metrics.inc("rewriter_" + k, counters[k])
+            for sect, value in sizes.items():
+                metrics.inc("ind_bytes", int(value, 16), lib=sect.replace(".text.", ""))
+            logger.info("Binary rewriting {:<32} (time: {}) {} ".format(name + "_aslr", elapsed, SUCCESS))
+
+        # Single write of the indirection sizes
+        binary_rewriter.save_maps_size(json_file, maps_size_libs)
 
     def update_link_file_spacer(self, use_custom_loader):
 
+        self.compute_layout_spacer(use_custom_loader)
+
+        if self.state_file is not None:
+            self.save_state()
+
+        # Read and write to files
+        for uk in self.uks:
+            self.write_link_file_spacer(uk)
+
+        self.relink_all()
+
+    @metrics.timed("layout")
+    def compute_layout_spacer(self, use_custom_loader):
+
         logger.info("Processing the mapping for {} unikernels".format(len(self.uks)))
 
         # Common libs (.text)
@@ -205,6 +580,7 @@ class UkManager:
         self.compute_loc(".text", self.common_subset)
         if not use_custom_loader:
             self.compute_loc(".text", self.indivial)
+            self.reserve_gap(".text")
 
         # uk sections start
         self.loc_sect["_etext"] = self.loc_counter
@@ -217,6 +593,7 @@ class UkManager:
         self.compute_loc(".rodata", self.common_subset)
         if not use_custom_loader:
             self.compute_loc(".rodata", self.indivial)
+            self.reserve_gap(".rodata")
         
         # Align to page boundary
         self.loc_counter = round_to_n(self.loc_counter, PAGE_SIZE)
@@ -229,31 +606,158 @@ class UkManager:
 
         if use_custom_loader:
             self.compute_loc(".text", self.indivial)
+            self.reserve_gap(".text")
             self.compute_loc(".rodata", self.indivial)
+            self.reserve_gap(".rodata")
             self.loc_counter = round_to_n(self.loc_counter, PAGE_SIZE)
         
-        # Computes max size of data and bss
+        # Computes max size of data and bss (and keep the reserve for the unikernels added later)
         for k in [".data", ".bss"]:
             self.loc_sect[k] = self.loc_counter
             # Compute next address for next section
             max_size_sect[k] = max(uk.total_size[k] for uk in self.uks)
-            self.loc_counter += round_to_n(max_size_sect[k] , PAGE_SIZE)
+            self.loc_counter += round_to_n(max_size_sect[k] + self.reserve, PAGE_SIZE)
         
         # For .intrstack
         self.loc_sect[".intrstack"] = self.loc_counter
 
-        # Read and write to files
+        if self.pack:
+            logger.info("Packing .text: {} bytes of padding instead of {} (saved {} bytes)".format(self.padding["packed"], self.padding["page"], self.padding["page"] - self.padding["packed"]))
+
+    @metrics.timed("write")
+    def write_link_file_spacer(self, uk):
+        plat = "lib" + uk.kvm_plat + "plat"
+        path = os.path.join(self.workspace, uk.name, "build")
+        with open(os.path.join(path, plat, "link64_out.lds"), "w") as file_out:
+            file_out.write(self.process_link64_spacer(uk))
+            logger.info("Written link64_out.lds in {}/ ".format(path + "/" + plat))
+        if self.must_relink:
+            self.relink(uk.name, path, uk.use_vfscore, uk.kvm_plat)
+
+    def reserve_gap(self, type_sect):
+        # Free space for the libs of unikernels added later (see add_unikernel)
+        if ".text" in type_sect:
+            self.loc_counter = round_to_n(self.loc_counter, PAGE_SIZE)
+            size = round_to_n(self.reserve, PAGE_SIZE)
+        else:
+            size = self.reserve
+        self.gaps[type_sect] = [self.loc_counter, self.loc_counter + size]
+        self.loc_counter += size
+
+    def save_state(self):
+        state = FleetState()
+        state.loc_sect = dict(self.loc_sect)
+        state.gaps = self.gaps
+        state.reserve = self.reserve
+        for k in LAYOUT_SECT:
+            state.common[k] = dict(self.placements.get(k, dict()))
+            for lib, addr in state.common[k].items():
+                state.add_slot(lib, k, addr, self.global_maps[lib].total_size[k])
+
         for uk in self.uks:
-            plat = "lib" + uk.kvm_plat + "plat"
-            path = os.path.join(self.workspace, uk.name, "build")
-            with open(os.path.join(path, plat, "link64.lds"), "r") as file_in, open(os.path.join(path, plat, "link64_out.lds"), "w") as file_out:
-                file_out.write(self.process_link64_spacer(file_in.read().splitlines(), uk))
-                logger.info("Written link64_out.lds in {}/ ".format(path + "/" + plat))
-            if self.must_relink:
-                self.relink(path, uk.use_vfscore, uk.kvm_plat)
+            state.unikernels[uk.name] = {k: dict(uk.placements.get(k, dict())) for k in LAYOUT_SECT}
+            state.unikernels[uk.name]["total_size"] = {k: uk.total_size.get(k, 0) for k in [".data", ".bss"]}
+            for k in LAYOUT_SECT:
+                # The space of a lib is its biggest size in the fleet
+                for lib, addr in uk.placements.get(k, dict()).items():
+                    state.add_slot(lib, k, addr, self.global_maps[lib].total_size[k])
+
+        for name, ukLib in self.global_maps.items():
+            state.libs[name] = {
+                "size": {k: ukLib.total_size.get(k, 0) for k in LAYOUT_SECT},
+                "users": [uk.name for uk in self.uks if name in uk.objects],
+                "obj": self.objs_files[name][0] if name in self.objs_files else None
+            }
+        state.save(self.state_file)
 
-    def relink(self, path, use_vfscore, kvm_plat):           
-        os.chdir(path)
+    def add_unikernel(self, name, sections_info=None):
+
+        if self.state_file is None or not os.path.isfile(self.state_file):
+            logger.fatal("A state file (--state) of an aligned fleet is required to add {}".format(name))
+            sys.exit(1)
+        if self.aslr != 0:
+            logger.fatal("Adding a unikernel is only supported without aslr")
+            sys.exit(1)
+
+        state = FleetState.load(self.state_file)
+        if name in state.unikernels:
+            logger.warning("{} is already part of the fleet, it is placed again".format(name))
+            del state.unikernels[name]
+
+        uk = Unikernel(name, os.path.join(self.workspace, name))
+        path = os.path.join(uk.workspace, "build/")
+
+        # Use the same objects as the fleet
+        if self.copy_objs:
+            for lib in uk.list_objects(path):
+                obj = lib.replace(OBJ_EXT, "")
+                if obj in state.libs and state.libs[obj]["obj"] is not None and not os.path.samefile(state.libs[obj]["obj"], path + lib):
+                    if self.store is not None:
+                        self.store.materialize(self.store.add(state.libs[obj]["obj"]), path + lib)
+                    else:
+                        shutil.copyfile(state.libs[obj]["obj"], path + lib)
+                    if sections_info is not None:
+                        # The copy has the sections of the object of the fleet (read again if unknown)
+                        sections_info[path + lib] = sections_info.get(state.libs[obj]["obj"])
+            if self.store is not None:
+                self.store.report()
+
+        logger.info("Process {} ".format(name))
+        uk.process_build_folder(path, self.global_maps, self.objs_files, sections_info=sections_info)
+
+        self.loc_sect = state.loc_sect
+        placed = list()
+        for type_sect in LAYOUT_SECT:
+            sb = StringBuilder()
+            uk.sb_link[type_sect] = StringBuilder()
+
+            # Common libs keep their address
+            for lib, addr in state.common[type_sect].items():
+                if lib not in uk.objects:
+                    continue
+                if uk.objects[lib].total_size[type_sect] > state.slot(lib, type_sect, addr):
+                    logger.fatal("{}({}) of {} is bigger than in the fleet: a full alignment is required".format(lib, type_sect, name))
+                    sys.exit(1)
+                sb.append("  ").append(type_sect).append(".").append(lib).append(" 0x{:x} : ".format(addr)).append("{ ").append(lib).append(OBJ_EXT).append("(").append(type_sect).append("); }\n")
+            self.sb_link[type_sect] = sb.to_str()
+
+            # Other libs reuse an address of the fleet or are placed in the reserved gap
+            for lib, ukLib in uk.objects.items():
+                size = ukLib.total_size[type_sect]
+                if lib in state.common[type_sect] or size == 0:
+                    continue
+                addr = state.place(lib, type_sect, size, ukLib.sections[type_sect].addralign, placed)
+                if addr is None:
+                    logger.fatal("No space left for {}({}) of {}: a full alignment (with a bigger --reserve) is required".format(lib, type_sect, name))
+                    sys.exit(1)
+                uk.placements.setdefault(type_sect, dict())[lib] = addr
+
+            for lib, addr in sorted(uk.placements.get(type_sect, dict()).items(), key=lambda x: x[1]):
+                uk.sb_link[type_sect].append("  ").append(type_sect).append(".").append(lib).append(" 0x{:x} : ".format(addr)).append("{ ").append(lib).append(OBJ_EXT).append("(").append(type_sect).append("); }\n")
+
+        # .data and .bss must fit in the space of the fleet
+        for k, end in [(".data", ".bss"), (".bss", ".intrstack")]:
+            if uk.total_size.get(k, 0) > self.loc_sect[end] - self.loc_sect[k]:
+                logger.fatal("{} of {} is bigger than in the fleet: a full alignment (with a bigger --reserve) is required".format(k, name))
+                sys.exit(1)
+
+        self.write_link_file_spacer(uk)
+        self.relink_all()
+
+        # Update the state with the new unikernel
+        state.unikernels[name] = {k: dict(uk.placements.get(k, dict())) for k in LAYOUT_SECT}
+        state.unikernels[name]["total_size"] = {k: uk.total_size.get(k, 0) for k in [".data", ".bss"]}
+        for lib, ukLib in uk.objects.items():
+            if lib not in state.libs:
+                state.libs[lib] = {"size": {k: 0 for k in LAYOUT_SECT}, "users": list(), "obj": self.objs_files[lib][0]}
+            for k in LAYOUT_SECT:
+                state.libs[lib]["size"][k] = max(state.libs[lib]["size"][k], ukLib.total_size[k])
+            if name not in state.libs[lib]["users"]:
+                state.libs[lib]["users"].append(name)
+        state.save(self.state_file)
+        self.uks.append(uk)
+
+    def relink(self, name, path, use_vfscore, kvm_plat):
         
         aslr = ""
         if self.aslr != 0:
@@ -273,74 +777,65 @@ class UkManager:
                 f.write(LDS_NETDEV)
         cmd = 'gcc -nostdlib -Wl,--omagic -Wl,--build-id=none -nostdinc -no-pie -Wl,-m,elf_x86_64 -Wl,-m,elf_x86_64 -Wl,-dT,{}/lib{}plat/link64_out{}.lds -Wl,-T,{}/lib/uksched/extra{}.ld {} -o unikernel_{}-x86_64_local_align{}.dbg'.format(path, kvm_plat, aslr, self.unikraft_path, aslr, linker_add, kvm_plat, aslr)
         logger.info(cmd)
-        p = subprocess.run(shlex.split(cmd))
-        if p.returncode == 0:
-            logger.info("Relinking {:<32} {}".format(path.split("/")[5], SUCCESS))
-        else:
-            logger.error("Relinking failed ({})".format(path.split("/")[5]))
-            
-    def process_link64_spacer_aslr(self, lines, uk):
-        done = False
-        sb = StringBuilder()
-        for l in lines:
-            if  "*(.text)" in l or "*(.rodata)" in l:
-                sb.append(" }\n")
-                continue
-            elif "*(.text.*)" in l:
-                sb.append(self.sb_link[".text"])
-                done = True
-                continue
-            elif done and "}" in l:
-                done = False
-                continue
-            elif "*(.rodata.*)" in l:
-                sb.append(self.sb_link[".rodata"].to_str())
-                sb.append(self.sb_link[".rodata_uk"].to_str())
-                done = True
-                continue
-            
-            sb.append(l).append("\n")
-        
-        return sb.to_str()
 
-    def process_link64_spacer(self, lines, uk):
-        done = False
-        sb = StringBuilder()
-        for l in lines:
-            if  "*(.text)" in l or "*(.rodata)" in l:
-                sb.append(" }\n")
-                continue
-            elif "_etext = .;" in l:
-                sb.append(l + "\n")
-                sb.append(" . = ").append("0x{:x}".format(self.loc_sect["_etext"])).append(";\n")
-                continue
-            elif "*(.text.*)" in l:
-                sb.append(self.sb_link[".text"])
-                sb.append(uk.sb_link[".text"].to_str())
-                done = True
-                continue
-            elif done and "}" in l:
-                done = False
-                continue
-            elif "_ctors = .;" in l or "_ectors = .;" in l:
-                sb.append(" . = ").append("0x{:x}".format(self.loc_sect[l.split("=")[0].strip()])).append(";\n")
-            elif "*(.rodata.*)" in l:
-                sb.append(self.sb_link[".rodata"])
-                sb.append(uk.sb_link[".rodata"].to_str())
-                done = True
-                continue
-            elif l in [" .init_array : {", " _data = .;", " __bss_start = .;", " .intrstack :"]:
-                x = re.findall(r"[a-z]+", l)
+        # The job is only run by relink_all
+        self.relink_jobs.append((name, path, cmd))
+
+    @metrics.timed("relink")
+    def relink_all(self):
+        if len(self.relink_jobs) == 0:
+            return list()
 
-                if len(x) > 1 and "start" not in x:
-                    x = '.'+'_'.join(x)
+        logger.info("Relinking {} unikernels with {} jobs".format(len(self.relink_jobs), self.jobs))
+        start = time.time()
+        failures = list()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(run_relink, name, path, cmd) for name, path, cmd in self.relink_jobs]
+            for future in futures:
+                name, returncode, elapsed, stderr = future.result()
+                if returncode == 0:
+                    logger.info("Relinking {:<32} (time: {:.3f}) {}".format(name, elapsed, SUCCESS))
+                    metrics.inc("relinked_unikernels")
                 else:
-                    x = '.'+''.join(x[0])
-                sb.append(" . = ").append("0x{:x}".format(self.loc_sect[x])).append(";\n")
-            sb.append(l).append("\n")
-        
-        return sb.to_str()
+                    failures.append((name, returncode, stderr))
+                    metrics.inc("relink_failures")
+        self.relink_jobs = list()
+
+        # Report all the failures together
+        for name, returncode, stderr in failures:
+            logger.error("Relinking failed ({}) - exit code {}\n{}".format(name, returncode, stderr.strip()))
+        if len(failures) > 0:
+            logger.error("Relinking failed for {}/{} unikernels".format(len(failures), len(futures)))
+        logger.info("Relinking done (time: {:.3f})".format(time.time() - start))
+        return [name for name, _, _ in failures]
 
+    def link_template(self, uk, aslr):
+        # link64.lds is the same for all the unikernels of a platform: parse it once
+        key = (uk.kvm_plat, aslr)
+        if key not in self.templates:
+            plat = "lib" + uk.kvm_plat + "plat"
+            try:
+                self.templates[key] = LinkTemplate.load(os.path.join(self.workspace, uk.name, "build", plat, "link64.lds"), aslr)
+            except ValueError as e:
+                logger.fatal("Unexpected linker script - {}".format(e))
+                sys.exit(1)
+        return self.templates[key]
+
+    def process_link64_spacer_aslr(self, uk):
+        fragments = {
+            TEXT_SLOT: [self.sb_link[".text"]],
+            RODATA_SLOT: [self.sb_link[".rodata"].to_str(), self.sb_link[".rodata_uk"].to_str()]
+        }
+        return self.link_template(uk, True).render(fragments)
+
+    def process_link64_spacer(self, uk):
+        fragments = {
+            TEXT_SLOT: [self.sb_link[".text"], uk.sb_link[".text"].to_str()],
+            RODATA_SLOT: [self.sb_link[".rodata"], uk.sb_link[".rodata"].to_str()]
+        }
+        return self.link_template(uk, False).render(fragments, self.loc_sect)
+
+    @metrics.timed("copy")
     def copy_all_objs(self):
         
         logger.info("Uniform objects for {} unikernels".format(len(self.uks)))
@@ -368,4 +863,10 @@ class UkManager:
                     
                     if os.path.samefile(newsrc, oldsrc):
                         continue
-                    shutil.copyfile(newsrc, oldsrc)
+                    if self.store is not None:
+                        self.store.materialize(self.store.add(newsrc), oldsrc)
+                    else:
+                        shutil.copyfile(newsrc, oldsrc)
+
+        if self.store is not None:
+            self.store.report()
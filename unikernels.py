@@ -32,13 +32,44 @@
 import os
 import shutil
 
-from elftools.elf.elffile import ELFFile
+from elfReader import read_section_headers
 from utils import round_to_n, logger
 from collections import defaultdict
 from stringBuilder import StringBuilder
+from metrics import metrics
 
 PAGE_SIZE = 0x1000
 OBJ_EXT   = ".o"
+SEC_NAME  = [".data", ".rodata", ".text", ".bss"]
+
+def read_sections(path, s_name, backend="mmap"):
+    # Returns the ELF type and the (name, size, addr, offset, addralign) of each section
+    if backend == "mmap":
+        try:
+            return read_section_headers(path, s_name)
+        except ValueError as e:
+            logger.debug("Use pyelftools for {}".format(e))
+    return read_sections_pyelftools(path, s_name)
+
+def read_sections_pyelftools(path, s_name):
+    from elftools.elf.elffile import ELFFile
+    from elftools.common.exceptions import ELFError
+
+    sections = list()
+    try:
+        with open(path, 'rb') as f:
+            elf =  ELFFile(f)
+            filetype = elf["e_type"]
+            for s in s_name:
+                sec = elf.get_section_by_name(s)
+                if sec is not None:
+                    sections.append((sec.name, sec["sh_size"], sec["sh_addr"], sec["sh_offset"], sec["sh_addralign"]))
+                else:
+                    sections.append(None)
+    except ELFError as e:
+        # Same error as the mmap reader (e.g. an object being written by a build)
+        raise ValueError("{}: {}".format(path, e))
+    return filetype, sections
 
 class UkSection:
     def __init__(self, name, size, addr, offset, addralign):
@@ -78,6 +109,7 @@ class Unikernel:
         self.objects = dict()
         self.total_size = dict()
         self.sb_link = dict()
+        self.placements = dict()
         self.map_symbols = defaultdict(list)
         self.kvm_plat = "kvmq"
 
@@ -122,12 +154,44 @@ class Unikernel:
                 if ".text" not in type_sect:
                     self.loc_counter = round_to_n(self.loc_counter, ukLib.sections[type_sect].addralign)
                 
+                self.placements.setdefault(type_sect, dict())[ukLib.name] = self.loc_counter
                 self.sb_link[type_sect].append("  ").append(type_sect).append(".").append(ukLib.name).append(" 0x{:x} : ".format(self.loc_counter)).append("{ ").append(ukLib.name).append(OBJ_EXT).append("(").append(type_sect).append("); }\n")
                 if ".text" in type_sect:
                     self.loc_counter += round_to_n(ukLib.total_size[type_sect], PAGE_SIZE)
                 else:
                     self.loc_counter += ukLib.total_size[type_sect]
 
+    def update_loc_counter_packed(self, type_sect, groups):
+
+        if type_sect not in self.sb_link:
+            self.sb_link[type_sect] = StringBuilder()
+
+        # Libs of a group are packed together, pages boundaries are only kept between groups
+        page_padding = 0
+        packed_padding = 0
+        for users, libs in groups.items():
+            if self.name not in users:
+                continue
+
+            start = self.loc_counter
+            used = 0
+            for ukLib in libs:
+                if ukLib.total_size[type_sect] == 0:
+                    logger.warning("Skip {} has a size of 0 ({})".format(ukLib.name + "(" + type_sect + ")", self.name))
+                    continue
+
+                self.loc_counter = round_to_n(self.loc_counter, max(1, ukLib.sections[type_sect].addralign))
+                self.placements.setdefault(type_sect, dict())[ukLib.name] = self.loc_counter
+                self.sb_link[type_sect].append("  ").append(type_sect).append(".").append(ukLib.name).append(" 0x{:x} : ".format(self.loc_counter)).append("{ ").append(ukLib.name).append(OBJ_EXT).append("(").append(type_sect).append("); }\n")
+                self.loc_counter += ukLib.total_size[type_sect]
+                used += ukLib.total_size[type_sect]
+                page_padding += round_to_n(ukLib.total_size[type_sect], PAGE_SIZE) - ukLib.total_size[type_sect]
+
+            self.loc_counter = round_to_n(self.loc_counter, PAGE_SIZE)
+            packed_padding += self.loc_counter - start - used
+
+        return page_padding, packed_padding
+
     def increment_sect(self, ukSection, ukLib):
     
         if ukLib.filetype == "ET_EXEC":
@@ -141,56 +205,65 @@ class Unikernel:
             ukLib.total_size[ukSection.name] = ukSection.size
             self.objects[ukLib.name] = ukLib
 
-    def process_file(self, path, libname, s_name):
+    def process_file(self, path, libname, s_name, info=None):
 
         ukLib = UkLib(libname)
-        with open(path + libname, 'rb') as f:
-            elf =  ELFFile(f)
-            ukLib.filetype = elf["e_type"]
-            for s in s_name:
-                sec = elf.get_section_by_name(s)
-                if sec is not None:
-                    ukSection = UkSection(sec.name, sec["sh_size"], sec["sh_addr"], sec["sh_offset"], sec["sh_addralign"])
-                else:
-                    ukSection = UkSection(s, 0x0, 0x0, 0x0, 0x0)
-                    logger.warning("{} does not contain {}".format(libname, s))
-                
-                ukLib.sections[s] = ukSection
-                self.increment_sect(ukSection, ukLib)
+        if info is None:
+            info = read_sections(path + libname, s_name)
+            metrics.inc("objects_parsed")
+            metrics.inc("object_bytes_parsed", os.path.getsize(path + libname))
+
+        ukLib.filetype, sections = info
+        for s, sec in zip(s_name, sections):
+            if sec is not None:
+                ukSection = UkSection(*sec)
+            else:
+                ukSection = UkSection(s, 0x0, 0x0, 0x0, 0x0)
+                logger.warning("{} does not contain {}".format(libname, s))
+
+            ukLib.sections[s] = ukSection
+            self.increment_sect(ukSection, ukLib)
         
         return ukLib
 
-    def process_build_folder(self, path, global_maps, objs_files, update=True):
-
-        sec_name = [".data", ".rodata", ".text", ".bss"]
+    def list_objects(self, path):
+        libs = list()
         for lib in sorted(os.listdir(path)):
-            if "x86_64" not in lib and OBJ_EXT in lib:
-                
-                if ".ld.o" in lib:
-                    continue
+            if "x86_64" not in lib and OBJ_EXT in lib and ".ld.o" not in lib:
+                libs.append(lib)
+        return libs
 
-                # Map object files (take the biggest one)
-                libname = lib.replace(OBJ_EXT, "")
-                if libname in objs_files:
-                    path_map, size = objs_files[libname]
-                    if size < os.path.getsize(os.path.join(path, lib)):
-                        objs_files[libname] = (os.path.join(path, lib), os.path.getsize(os.path.join(path, lib)))
-                else:
+    def process_build_folder(self, path, global_maps, objs_files, update=True, sections_info=None):
+
+        for lib in self.list_objects(path):
+
+            # Map object files (take the biggest one)
+            libname = lib.replace(OBJ_EXT, "")
+            if libname in objs_files:
+                path_map, size = objs_files[libname]
+                if size < os.path.getsize(os.path.join(path, lib)):
                     objs_files[libname] = (os.path.join(path, lib), os.path.getsize(os.path.join(path, lib)))
-            
-                ukLib = self.process_file(path, lib, sec_name)
-                if "vfscore" in lib:
-                    self.use_vfscore = True
-                elif "libkvmfcplat" in lib:
-                    self.kvm_plat = "kvmfc"
-                elif "libuklibparam" in lib:
-                    self.use_uklibparam = True
-                    
-                # Skip update (for process ASLR script)
-                if not update:
-                    continue
+            else:
+                objs_files[libname] = (os.path.join(path, lib), os.path.getsize(os.path.join(path, lib)))
+
+            # Use the sections already read by a worker (parallel scan) if any
+            info = None
+            if sections_info is not None:
+                info = sections_info.get(path + lib)
+
+            ukLib = self.process_file(path, lib, SEC_NAME, info)
+            if "vfscore" in lib:
+                self.use_vfscore = True
+            elif "libkvmfcplat" in lib:
+                self.kvm_plat = "kvmfc"
+            elif "libuklibparam" in lib:
+                self.use_uklibparam = True
                 
-                if ukLib.name not in global_maps:
-                    global_maps[ukLib.name] = ukLib
-                else:
-                    global_maps[ukLib.name].update(ukLib)
\ No newline at end of file
+            # Skip update (for process ASLR script)
+            if not update:
+                continue
+            
+            if ukLib.name not in global_maps:
+                global_maps[ukLib.name] = ukLib
+            else:
+                global_maps[ukLib.name].update(ukLib)
\ No newline at end of file
@@ -30,6 +30,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import math
+import hashlib
 import logging
 
 SUCCESS = '\033[92m' + "[SUCCESS]" + "\x1b[0m"
@@ -72,4 +73,11 @@ def round_to_n(x, base):
 
 def global_maps_display(global_maps):
     for k,v in global_maps.items():
-        print(k + " (" + str(v.occurence) + "): " + str(v.ukLib.total_size))
\ No newline at end of file
+        print(k + " (" + str(v.occurence) + "): " + str(v.ukLib.total_size))
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
\ No newline at end of file